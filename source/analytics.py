@@ -0,0 +1,129 @@
+import numpy as np
+
+
+# Measurements over whole trajectories, every function takes the structured array from
+# DataLog.get_trajectory (frame, timestamp, x, y, angle) and works on all samples at once.
+# frames without a lock are logged as (-1, -1), -1 and come out as nan, so they drop out of sums and means
+
+
+# x and y in pixels as float64, nan where there was no lock
+def positions(samples):
+    locked = samples['angle'] >= 0
+    x = np.where(locked, np.asarray(samples['x'], np.float64), np.nan)
+    y = np.where(locked, np.asarray(samples['y'], np.float64), np.nan)
+    return x, y
+
+
+def angles(samples):
+    return np.where(samples['angle'] >= 0, samples['angle'], np.nan).astype(np.float64)
+
+
+# seconds since the first sample, from the timestamps or the frame numbers if the run was logged without them
+def times(samples, framerate=30):
+    if len(samples) == 0:
+        return np.zeros(0)
+    timestamps = np.asarray(samples['timestamp'], np.float64)
+    if timestamps[-1] > timestamps[0]:
+        return timestamps - timestamps[0]
+    frames = np.asarray(samples['frame'], np.float64)
+    return (frames - frames[0]) / framerate
+
+
+# change of a series per second between consecutive samples, the first sample has none so it's nan
+def rate(values, t):
+    out = np.full(len(values), np.nan)
+    if len(values) > 1:
+        dt = np.diff(t)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out[1:] = np.where(dt > 0, np.diff(values) / dt, np.nan)
+    return out
+
+
+# (vx, vy) in pixels per second
+def velocity(samples, framerate=30):
+    x, y = positions(samples)
+    t = times(samples, framerate)
+    return rate(x, t), rate(y, t)
+
+
+# pixels per second
+def speed(samples, framerate=30):
+    vx, vy = velocity(samples, framerate)
+    return np.hypot(vx, vy)
+
+
+# change of speed in pixels per second squared
+def acceleration(samples, framerate=30):
+    return rate(speed(samples, framerate), times(samples, framerate))
+
+
+# degrees per second. the angle is of the body axis, which has no front, so 179 to 1 is a turn of 2 degrees
+def angular_velocity(samples, framerate=30):
+    a = angles(samples)
+    t = times(samples, framerate)
+    out = np.full(len(a), np.nan)
+    if len(a) > 1:
+        turn = (np.diff(a) + 90) % 180 - 90
+        dt = np.diff(t)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out[1:] = np.where(dt > 0, turn / dt, np.nan)
+    return out
+
+
+# distance walked in pixels, a step is only counted between two locked samples
+def path_length(samples):
+    x, y = positions(samples)
+    return float(np.nansum(np.hypot(np.diff(x), np.diff(y))))
+
+
+# path length over the straight distance from the first to the last locked position, 1 is a straight line
+def tortuosity(samples):
+    x, y = positions(samples)
+    locked = np.flatnonzero(~np.isnan(x))
+    if len(locked) < 2:
+        return np.nan
+    straight = np.hypot(x[locked[-1]] - x[locked[0]], y[locked[-1]] - y[locked[0]])
+    if straight == 0:
+        return np.inf
+    return path_length(samples) / straight
+
+
+# seconds spent in each region, regions is a dict of name -> (x, y, w, h) in pixels.
+# each sample counts for the time until the next one
+def dwell_times(samples, regions, framerate=30):
+    x, y = positions(samples)
+    t = times(samples, framerate)
+    dt = np.zeros(len(t))
+    if len(t) > 1:
+        dt[:-1] = np.diff(t)
+        dt[-1] = np.median(dt[:-1])
+    dwell = {}
+    for name, (rx, ry, rw, rh) in regions.items():
+        inside = (x >= rx) & (x < rx + rw) & (y >= ry) & (y < ry + rh)  # nan compares false
+        dwell[name] = float(np.sum(dt[inside]))
+    return dwell
+
+
+# counts of the locked positions in a grid over a frame of shape (height, width), bins across the width
+def occupancy(samples, shape, bins=32):
+    x, y = positions(samples)
+    height, width = shape
+    rows = max(int(round(bins * height / width)), 1)
+    inside = (x >= 0) & (x <= width) & (y >= 0) & (y <= height)  # nan compares false
+    col = np.minimum((x[inside] * (bins / width)).astype(np.intp), bins - 1)
+    row = np.minimum((y[inside] * (rows / height)).astype(np.intp), rows - 1)
+    return np.bincount(row * bins + col, minlength=rows * bins).reshape(rows, bins).astype(np.float64)
+
+
+# a few numbers that describe a run
+def describe(samples, framerate=30):
+    t = times(samples, framerate)
+    s = speed(samples, framerate)
+    locked = samples['angle'] >= 0
+    return {'samples': len(samples),
+            'duration': float(t[-1]) if len(t) > 0 else 0.0,
+            'lock_pct': float(np.mean(locked)) * 100 if len(samples) > 0 else 0.0,
+            'path_length': path_length(samples),
+            'tortuosity': tortuosity(samples),
+            'mean_speed': float(np.nanmean(s)) if np.any(~np.isnan(s)) else np.nan,
+            'max_speed': float(np.nanmax(s)) if np.any(~np.isnan(s)) else np.nan}
@@ -0,0 +1,158 @@
+import argparse
+import csv
+import multiprocessing
+import os
+import time
+from configparser import ConfigParser
+import cv2
+from source import camera
+
+
+# Headless tracking of recorded clips, runs the trackers as fast as frames can be decoded
+# usage (from the source folder, with the project root on the path like main.py):
+#   python -m source.batch ..\clips\antvideo.mp4 --tracker motion
+#   python -m source.batch ..\clips --workers 8
+
+
+VIDEO_EXTENSIONS = ('.avi', '.mp4')
+CONFIG_PATH = os.path.join('..', 'data', 'config.ini')
+OUTPUT_DIR = os.path.join('..', 'data', 'trajectories')
+
+
+def find_clips(path):
+    # a single file or every clip inside a directory
+    if os.path.isdir(path):
+        names = sorted(os.listdir(path))
+        return [os.path.join(path, name) for name in names if name.lower().endswith(VIDEO_EXTENSIONS)]
+    return [path]
+
+
+def make_tracker(name, config, roi=None, local_search=False, scale=None):
+    if name == 'hsv':
+        tracker = camera.TrackerHSV()
+        for key in tracker.color_ranges:
+            tracker.color_ranges[key] = config.getint('HSV', key)
+        tracker.set_mask_ranges()
+        section = 'HSV'
+    elif name == 'motion':
+        tracker = camera.TrackerMotion()
+        tracker.set_filter_thresh(config.getint('Motion', 'noise thresh'))
+        section = 'Motion'
+    else:
+        raise ValueError('Unknown tracker: {}'.format(name))
+    tracker.set_scale(scale or config.getfloat(section, 'scale', fallback=1))
+    tracker.set_roi(roi)
+    tracker.set_local_search(local_search, config.getint('Search', 'margin', fallback=40))
+    return tracker
+
+
+# tracks the first max_frames frames of a clip, or all of them
+def track_clip(path, tracker, max_frames=None):
+    trajectory = {'x': [], 'y': [], 'angle': []}
+    vid = cv2.VideoCapture(path)
+    if not vid.isOpened():
+        print('Could not open video', path)
+        return trajectory
+
+    while max_frames is None or len(trajectory['x']) < max_frames:
+        ret, frame = vid.read()
+        if not ret:
+            break
+        tracker.update(frame)
+        # same sentinel as MainController.record_data when there is no lock
+        if tracker.has_lock:
+            trajectory['x'].append(float(tracker.position[0]))
+            trajectory['y'].append(float(tracker.position[1]))
+            trajectory['angle'].append(float(tracker.angle))
+        else:
+            trajectory['x'].append(-1)
+            trajectory['y'].append(-1)
+            trajectory['angle'].append(-1)
+
+    vid.release()
+    return trajectory
+
+
+# each process already owns a core, stop opencv from spawning its own threads on top of that
+def init_worker():
+    cv2.setNumThreads(1)
+
+
+# func of every job, handed back as they finish. more than one worker runs them in a process pool,
+# used for tracking here and by source.render
+def run_jobs(func, jobs, workers=1):
+    if workers == 1:
+        yield from map(func, jobs)
+        return
+    pool = multiprocessing.Pool(processes=workers or None, initializer=init_worker)  # 0 uses every core
+    try:
+        yield from pool.imap_unordered(func, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+
+# runs inside a pool worker, so every clip gets its own capture and tracker
+def track_clip_worker(job):
+    clip, tracker_name, config_path, roi, local_search, scale = job
+    config = ConfigParser()
+    config.read(config_path)
+    start = time.perf_counter()
+    trajectory = track_clip(clip, make_tracker(tracker_name, config, roi, local_search, scale))
+    return clip, trajectory, time.perf_counter() - start
+
+
+def track_clips(clips, tracker_name, config_path, workers=1, roi=None, local_search=False, scale=None):
+    results = {}
+    jobs = [(clip, tracker_name, config_path, roi, local_search, scale) for clip in clips]
+    start = time.perf_counter()
+
+    for clip, trajectory, elapsed in run_jobs(track_clip_worker, jobs, workers):
+        results[clip] = trajectory
+        frames = len(trajectory['x'])
+        print('{}: {} frames in {:.2f}s ({:.1f} fps)'.format(clip, frames, elapsed,
+                                                           frames / max(elapsed, 1e-9)))
+
+    elapsed = time.perf_counter() - start
+    print('{} clips in {:.2f}s ({:.2f} clips/s)'.format(len(clips), elapsed, len(clips) / max(elapsed, 1e-9)))
+    return results
+
+
+def write_trajectory(trajectory, path):
+    with open(path, 'w', newline='') as write_file:
+        writer = csv.writer(write_file)
+        writer.writerow(['frame', 'x', 'y', 'angle'])
+        for i in range(len(trajectory['x'])):
+            writer.writerow([i, trajectory['x'][i], trajectory['y'][i], trajectory['angle'][i]])
+
+
+def output_path(clip, out_dir):
+    name = os.path.splitext(os.path.basename(clip))[0]
+    return os.path.join(out_dir, name + '.csv')
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Track recorded clips without the GUI')
+    parser.add_argument('path', help='video file or directory of .avi/.mp4 clips')
+    parser.add_argument('--tracker', choices=['motion', 'hsv'], default='motion')
+    parser.add_argument('--config', default=CONFIG_PATH, help='config.ini with the HSV and Motion settings')
+    parser.add_argument('--out', default=OUTPUT_DIR, help='directory the trajectory csv files are written to')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes, 0 uses every core')
+    parser.add_argument('--roi', default='', help='x,y,w,h region of the frame to track in')
+    parser.add_argument('--local-search', action='store_true',
+                        help='only search around the last position while the ant is locked')
+    parser.add_argument('--scale', type=float, default=None,
+                        help='size the tracker works at relative to the frame, defaults to the config')
+    args = parser.parse_args(args)
+
+    os.makedirs(args.out, exist_ok=True)
+
+    results = track_clips(find_clips(args.path), args.tracker, args.config, args.workers,
+                          camera.parse_roi(args.roi), args.local_search, args.scale)
+    for clip, trajectory in results.items():
+        write_trajectory(trajectory, output_path(clip, args.out))
+
+
+if __name__ == '__main__':
+    main()
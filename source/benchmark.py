@@ -0,0 +1,383 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from configparser import ConfigParser
+from datetime import datetime
+import cv2
+import numpy as np
+from source import analytics
+from source import batch
+from source import camera
+from source import data_handler
+from source import profiling
+
+
+# Performance checks for the tracking code
+# usage (from the source folder, with the project root on the path like main.py):
+#   python -m source.benchmark orientation
+#   python -m source.benchmark suite --out ..\data\benchmarks\before.json
+#   python -m source.benchmark analytics --hours 4
+#   python -m source.benchmark compare ..\data\benchmarks\before.json ..\data\benchmarks\after.json
+
+
+CLIP_PATH = os.path.join('..', 'clips', 'antvideo.mp4')
+RESULTS_DIR = os.path.join('..', 'data', 'benchmarks')
+RESOLUTIONS = [(640, 480), (1280, 720), (1920, 1080)]
+
+# fixed tracker settings so results don't change with whatever is in config.ini
+SETTINGS = {'HSV': {'low_h': 0, 'high_h': 19, 'low_s': 0, 'high_s': 79, 'low_v': 60, 'high_v': 143},
+            'Motion': {'noise thresh': 100}}
+ANT_COLOR = (95, 105, 120)  # BGR, inside the HSV range above
+
+
+# contours the motion tracker locks onto in a clip, along with the frame shape they came from
+def collect_contours(path, max_frames):
+    tracker = camera.TrackerMotion()
+    vid = cv2.VideoCapture(path)
+    contours = []
+    shape = None
+    while len(contours) < max_frames:
+        ret, frame = vid.read()
+        if not ret:
+            break
+        shape = frame.shape[:2]
+        tracker.update(frame)
+        if tracker.has_lock:
+            contours.append(tracker.contour)
+    vid.release()
+    return contours, shape
+
+
+def time_orientation(method, contours, shape):
+    pca = camera.PCA()
+    pca.orientation = method
+    results = []
+    start = time.perf_counter()
+    for c in contours:
+        pca.locate(c, shape)
+        results.append((pca.position.copy(), pca.angle))
+    return time.perf_counter() - start, results
+
+
+def bench_orientation(path, max_frames):
+    contours, shape = collect_contours(path, max_frames)
+    if len(contours) == 0:
+        print('No contours found in', path)
+        return None
+
+    pca_time, pca_results = time_orientation('pca', contours, shape)
+    moments_time, moments_results = time_orientation('moments', contours, shape)
+
+    position_error = [np.linalg.norm(a[0] - b[0]) for a, b in zip(pca_results, moments_results)]
+    angle_error = [abs(a[1] - b[1]) for a, b in zip(pca_results, moments_results)]
+    angle_error = [min(err, 180 - err) for err in angle_error]  # an axis at 0 and 180 degrees is the same axis
+
+    report = {'contours': len(contours),
+              'frame_shape': list(shape),
+              'pca_us': pca_time / len(contours) * 1e6,
+              'moments_us': moments_time / len(contours) * 1e6,
+              'speedup': pca_time / max(moments_time, 1e-9),
+              'position_error_mean': float(np.mean(position_error)),
+              'position_error_max': float(np.max(position_error)),
+              'angle_error_mean': float(np.mean(angle_error)),
+              'angle_error_median': float(np.median(angle_error)),
+              'angle_error_max': float(np.max(angle_error))}
+
+    print('{} contours from a {}x{} clip'.format(len(contours), shape[1], shape[0]))
+    print('pca:     {:.1f} us per contour'.format(report['pca_us']))
+    print('moments: {:.1f} us per contour ({:.1f}x faster)'.format(report['moments_us'], report['speedup']))
+    print('position difference: mean {:.3f}px, max {:.3f}px'.format(report['position_error_mean'],
+                                                                     report['position_error_max']))
+    print('angle difference: mean {:.3f}, median {:.3f}, max {:.3f} degrees'.format(
+        report['angle_error_mean'], report['angle_error_median'], report['angle_error_max']))
+    return report
+
+
+# writes a clip of a dark ellipse wandering over a textured background, the same clip every time
+def synthetic_clip(path, width, height, frames, fps=30):
+    rng = np.random.default_rng(0)
+    background = rng.integers(170, 230, (height, width, 3), dtype=np.uint8)
+    background = cv2.GaussianBlur(background, (5, 5), 0)
+    length = max(height // 40, 6)  # ant size follows the resolution like a real camera would
+
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, (width, height))
+    prev = None
+    for i in range(frames):
+        t = 2 * math.pi * i / frames
+        center = (width * (0.5 + 0.35 * math.sin(2 * t)), height * (0.5 + 0.35 * math.sin(3 * t)))
+        heading = 0 if prev is None else math.degrees(math.atan2(center[1] - prev[1], center[0] - prev[0]))
+        prev = center
+        frame = background.copy()
+        cv2.ellipse(frame, (int(center[0]), int(center[1])), (length, length // 3), heading, 0, 360, ANT_COLOR,
+                    cv2.FILLED)
+        writer.write(frame)
+    writer.release()
+
+
+def bench_config():
+    config = ConfigParser()
+    config.read_dict(SETTINGS)
+    return config
+
+
+# frames per second and per stage latency of one tracker, decoding isn't counted
+def bench_tracker(name, path, max_frames):
+    tracker = batch.make_tracker(name, bench_config())
+    tracker.timer.enabled = True
+    tracker.timer.window = None
+    vid = cv2.VideoCapture(path)
+    totals = []
+    while len(totals) < max_frames:
+        ret, frame = vid.read()
+        if not ret:
+            break
+        start = time.perf_counter()
+        tracker.update(frame)
+        totals.append(time.perf_counter() - start)
+    vid.release()
+
+    stages = {stage: profiling.percentiles(times) for stage, times in tracker.timer.times.items()}
+    stages['total'] = profiling.percentiles(totals)
+    return {'frames': len(totals),
+            'fps': len(totals) / max(sum(totals), 1e-9),
+            'stages': stages,
+            'peak_memory_mb': peak_memory(lambda: batch.track_clip(path, batch.make_tracker(name, bench_config()),
+                                                                   min(max_frames, 60))),
+            'peak_rss_mb': isolated_peak_rss(name, path, max_frames)}
+
+
+# frames per second through VideoCapture: threaded decode, tracking, the overlays and the RGB conversion
+def bench_pipeline(path, max_frames):
+    result = run_pipeline(path, max_frames)
+    result['peak_memory_mb'] = peak_memory(lambda: run_pipeline(path, min(max_frames, 60)))
+    result['peak_rss_mb'] = isolated_peak_rss('pipeline', path, max_frames)
+    return result
+
+
+def run_pipeline(path, max_frames):
+    video = camera.VideoCapture(path, 'left')
+    video.use_tracker = 'motion'
+    video.set_scale('motion', 1)
+    video.trackers['motion'].set_filter_thresh(SETTINGS['Motion']['noise thresh'])
+    video.use_overlay = 'mask'
+    # the per stage timings of VideoCapture and its tracker, drawing the overlay is its own stage there
+    video.enable_profiling(True)
+    video.timer.window = None
+    video.cur_tracker.timer.window = None
+    updates = []
+    start = time.perf_counter()
+    while len(updates) < max_frames and video.active:
+        t = time.perf_counter()
+        if video.update() is None:
+            time.sleep(0.001)
+            continue
+        updates.append(time.perf_counter() - t)
+        video.get_frame()
+    elapsed = time.perf_counter() - start
+    video.stop_reader()
+
+    # read, track, overlay and get_frame from the capture, then the tracker's own stages
+    stages = {'update': profiling.percentiles(updates)}
+    for timer in (video.timer, video.cur_tracker.timer):
+        stages.update({stage: profiling.percentiles(times) for stage, times in timer.times.items()})
+    return {'frames': len(updates),
+            'fps': len(updates) / max(elapsed, 1e-9),
+            'stages': stages}
+
+
+# most memory python and numpy had allocated at once while running func. opencv's own allocations,
+# like the knn background model and its mats, aren't seen here, peak_rss counts those
+def peak_memory(func):
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 2 ** 20
+
+
+# most memory the whole process has held at once so far in MB, None without resource or psutil
+def peak_rss():
+    if os.path.exists('/proc/self/status'):
+        # linux, ru_maxrss below carries over from the parent into a spawned process
+        with open('/proc/self/status', 'r') as read_file:
+            for line in read_file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 2 ** 10
+    try:
+        import resource
+    except ImportError:  # windows
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / 2 ** 20
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if platform.system() == 'Darwin':
+        return peak / 2 ** 20  # bytes on macos, kilobytes everywhere else
+    return peak / 2 ** 10
+
+
+# peak_rss of a new process that only runs one benchmark, the suite's own process never lets go of its peak.
+# target None runs nothing, for the memory python, numpy and opencv take before any tracking
+def isolated_peak_rss(target, path=None, max_frames=0):
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(rss_worker, ((target, path, max_frames),))
+
+
+def rss_worker(job):
+    target, path, max_frames = job
+    if target == 'pipeline':
+        run_pipeline(path, max_frames)
+    elif target is not None:
+        batch.track_clip(path, batch.make_tracker(target, bench_config()), max_frames)
+    return peak_rss()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(clip, resolutions, frames):
+    sources = []
+    if os.path.exists(clip):
+        vid = cv2.VideoCapture(clip)
+        size = '{}x{}'.format(int(vid.get(cv2.CAP_PROP_FRAME_WIDTH)), int(vid.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        vid.release()
+        sources.append((os.path.basename(clip), size, clip))
+
+    temp_dir = tempfile.TemporaryDirectory()
+    for width, height in resolutions:
+        path = os.path.join(temp_dir.name, 'synthetic_{}x{}.avi'.format(width, height))
+        synthetic_clip(path, width, height, frames)
+        sources.append(('synthetic', '{}x{}'.format(width, height), path))
+
+    results = []
+    for name, size, path in sources:
+        for target in ['motion', 'hsv', 'pipeline']:
+            if target == 'pipeline':
+                result = bench_pipeline(path, frames)
+            else:
+                result = bench_tracker(target, path, frames)
+            result.update({'source': name, 'resolution': size, 'target': target})
+            results.append(result)
+            print('{:<14} {:>10} {:<9} {:7.1f} fps'.format(name, size, target, result['fps']))
+    temp_dir.cleanup()
+
+    return {'commit': git_commit(),
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'frames': frames,
+            'baseline_rss_mb': isolated_peak_rss(None),
+            'results': results}
+
+
+# fps of every benchmark both result files ran, new against old
+def compare(old_path, new_path):
+    with open(old_path, 'r') as read_file:
+        old = json.load(read_file)
+    with open(new_path, 'r') as read_file:
+        new = json.load(read_file)
+
+    old_results = {(r['source'], r['resolution'], r['target']): r for r in old['results']}
+    print('{} ({}) -> {} ({})'.format(old_path, old.get('commit'), new_path, new.get('commit')))
+    for result in new['results']:
+        key = (result['source'], result['resolution'], result['target'])
+        if key not in old_results:
+            continue
+        before = old_results[key]['fps']
+        change = (result['fps'] - before) / max(before, 1e-9) * 100
+        print('{:<14} {:>10} {:<9} {:7.1f} -> {:7.1f} fps ({:+.1f}%)'.format(*key, before, result['fps'], change))
+
+
+# every analytics function over a synthetic run of the given length, with some frames missing a lock
+def bench_analytics(hours, framerate=30):
+    n = int(hours * 3600 * framerate)
+    samples = np.zeros(n, dtype=data_handler.TRAJECTORY_DTYPE)
+    t = np.arange(n)
+    samples['frame'] = t
+    samples['timestamp'] = t / framerate
+    samples['x'] = 320 + 200 * np.sin(t / 300)
+    samples['y'] = 240 + 150 * np.sin(t / 170)
+    samples['angle'] = t % 180
+    samples['angle'][::7] = -1
+
+    tests = {'speed': lambda: analytics.speed(samples, framerate),
+             'acceleration': lambda: analytics.acceleration(samples, framerate),
+             'angular_velocity': lambda: analytics.angular_velocity(samples, framerate),
+             'path_length': lambda: analytics.path_length(samples),
+             'tortuosity': lambda: analytics.tortuosity(samples),
+             'dwell_times': lambda: analytics.dwell_times(samples, {'left': (0, 0, 320, 480)}, framerate),
+             'occupancy': lambda: analytics.occupancy(samples, (480, 640)),
+             'describe': lambda: analytics.describe(samples, framerate)}
+    print('{} samples ({} hours at {} fps)'.format(n, hours, framerate))
+    report = {}
+    for name, func in tests.items():
+        start = time.perf_counter()
+        func()
+        report[name] = (time.perf_counter() - start) * 1000
+        print('{:<17} {:8.1f} ms'.format(name, report[name]))
+    return report
+
+
+def parse_resolutions(text):
+    return [tuple(int(val) for val in size.split('x')) for size in text.split(',')]
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Tracking benchmarks')
+    subparsers = parser.add_subparsers(dest='bench', required=True)
+
+    orientation = subparsers.add_parser('orientation', help='moment based orientation against the pca path')
+    orientation.add_argument('--clip', default=CLIP_PATH)
+    orientation.add_argument('--frames', type=int, default=500, help='number of locked frames to compare')
+
+    suite = subparsers.add_parser('suite', help='trackers and the capture pipeline on the clip and synthetic videos')
+    suite.add_argument('--clip', default=CLIP_PATH)
+    suite.add_argument('--resolutions', type=parse_resolutions,
+                       default=RESOLUTIONS, help='synthetic video sizes, for example 640x480,1920x1080')
+    suite.add_argument('--frames', type=int, default=300, help='frames run through each benchmark')
+    suite.add_argument('--out', default=None, help='json file for the results, defaults to the commit name')
+
+    trajectory = subparsers.add_parser('analytics', help='trajectory analytics over a long synthetic run')
+    trajectory.add_argument('--hours', type=float, default=4)
+
+    comparison = subparsers.add_parser('compare', help='fps change between two suite result files')
+    comparison.add_argument('old')
+    comparison.add_argument('new')
+
+    args = parser.parse_args(args)
+    if args.bench == 'orientation':
+        bench_orientation(args.clip, args.frames)
+    elif args.bench == 'suite':
+        report = run_suite(args.clip, args.resolutions, args.frames)
+        out = args.out
+        if out is None:
+            os.makedirs(RESULTS_DIR, exist_ok=True)
+            name = report['commit'] or datetime.now().strftime('%Y%m%d-%H%M%S')
+            out = os.path.join(RESULTS_DIR, '{}.json'.format(name))
+        with open(out, 'w') as write_file:
+            json.dump(report, write_file, indent=4)
+        print('saved', out)
+    elif args.bench == 'analytics':
+        bench_analytics(args.hours)
+    elif args.bench == 'compare':
+        compare(args.old, args.new)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,13 @@ import cv2
 import numpy as np
 import imutils
 import math
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from source import profiling
 
 
 class PCA:
@@ -10,14 +16,42 @@ class PCA:
         self.mean = np.array([0, 0])  # global mean
         self.eigens = np.full((1, 2), 0)  # global eigenvectors
 
-        self.prev_position = np.array([0, 0])
-        self.prev_time = 0.0
+        # 'moments' gets the center and axes straight from the contour,
+        # 'pca' draws the contour into a frame sized mask and runs PCA over its pixels
+        self.orientation = 'moments'
+
+    def locate(self, contour, shape):
+        if self.orientation == 'moments' and self.calculate_moments(contour):
+            return
+        self.calculate(self.contour_to_mask(contour, shape))
 
     def calculate(self, mask):
         # mean (e. g. the geometrical center)
         # and eigenvectors (e. g. directions of principal components)
         self.mean, self.eigens = cv2.PCACompute(mask, mean=np.array([]))
         self.mean = self.mean.ravel()  # convert from a 2D array to 1D array for x and y coord of mean
+        self.eigens = self.orient(self.eigens)
+
+    # same center and principal axes as the pca path, but without touching a single pixel:
+    # the central moments of the contour are its covariance matrix scaled by the area
+    def calculate_moments(self, contour):
+        M = cv2.moments(contour)
+        if M['m00'] == 0:  # contour with no area, let the pca path deal with it
+            return False
+        self.mean = np.array([M['m10'] / M['m00'], M['m01'] / M['m00']], np.float32)
+        covariance = np.array([[M['mu20'], M['mu11']],
+                               [M['mu11'], M['mu02']]]) / M['m00']
+        values, vectors = np.linalg.eigh(covariance)  # ascending eigenvalues, eigenvectors in columns
+        self.eigens = self.orient(vectors[:, ::-1].T.astype(np.float32))
+        return True
+
+    # the sign of an eigenvector is arbitrary, always point them to the right so the angle is repeatable
+    @staticmethod
+    def orient(eigens):
+        for i in range(len(eigens)):
+            if eigens[i][0] < 0 or (eigens[i][0] == 0 and eigens[i][1] < 0):
+                eigens[i] = -eigens[i]
+        return eigens
 
     @staticmethod
     def contour_to_mask(contour, shape):
@@ -52,6 +86,14 @@ class PCA:
 
         return np.int32(rectangle)  # convert to 32 bit cuz cv2 spazzes out if it's 64
 
+    # puts back a center and angle that were logged, so the box can be drawn again without the contour
+    def set_pose(self, position, angle):
+        radians = angle * 2 * 3.1415 / 360
+        self.mean = np.array(position, np.float32)
+        # angle is measured from the vertical and the main axis always points right, see orient
+        self.eigens = np.array([[math.sin(radians), math.cos(radians)],
+                                [math.cos(radians), -math.sin(radians)]], np.float32)
+
     @property
     def position(self):
         return self.mean
@@ -72,30 +114,209 @@ class PCA:
 
         return angle * 360 / (2 * 3.1415)  # angle in degrees
 
-    @property
-    def velocity(self):
-        velocity_vector = np.full((2, 2), 0)
-
-        curr_position = self.mean
-        curr_time = cv2.getTickCount()
-        elapsed_time = curr_time - self.prev_time
-        distance = curr_position - self.prev_position
 
-        velocity_vector[0] = curr_position
-        velocity_vector[1] = distance * 500000 / elapsed_time + curr_position
+# arrays kept between frames so opencv can write into them through dst instead of allocating new ones,
+# an array is only remade when the size asked for changes. when disabled get returns None, which opencv
+# takes as a request for a new array, so callers don't need to check
+class BufferPool:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.buffers = {}
 
-        self.prev_time = curr_time
-        self.prev_position = curr_position
-
-        return velocity_vector
+    def get(self, name, shape, dtype=np.uint8):
+        if not self.enabled:
+            return None
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype)
+            self.buffers[name] = buffer
+        return buffer
+
+    # copy of an image, kept in the pool
+    def copy(self, name, image):
+        buffer = self.get(name, image.shape, image.dtype)
+        if buffer is None:
+            return image.copy()
+        np.copyto(buffer, image)
+        return buffer
+
+    def clear(self):
+        self.buffers = {}
+
+
+# parses an 'x, y, w, h' region of interest, a zero width or height means the whole frame
+def parse_roi(text):
+    try:
+        x, y, w, h = (int(val) for val in text.split(','))
+    except (AttributeError, ValueError):
+        return None
+    if w <= 0 or h <= 0:
+        return None
+    return x, y, w, h
+
+
+class Tracker(PCA):
+    def __init__(self):
+        super().__init__()
+        self.has_lock = False
+        self.mask = None
+        self.contour = None  # contour of the lock in full frame coordinates
+        self.roi = None  # (x, y, w, h) of the full frame to process, None processes everything
+        self.offset = (0, 0)  # top left of the processed region in full frame coordinates
+        self.scale = 1  # size the masks are made at relative to the frame, 0.5 works on a half size image
+
+        # local search only looks around the last position while there is a lock
+        self.local_search = False
+        self.search_margin = 40  # smallest distance searched around the last position in pixels
+        self.search_lead = 3  # how many frames of the recent movement the window reaches ahead
+        self.last_pos = None
+        self.last_radius = 0  # half the diagonal of the last lock's bounding box, so a turn still fits
+        self.step = (0, 0)  # movement since the frame before, in pixels
+        self.steps = deque(maxlen=5)  # recent distances moved per frame
+        self.arrow_lead = 5  # frames of movement the velocity arrow reaches ahead
+
+        self.timer = profiling.StageTimer()  # per stage timings of update when enabled
+        self.buffers = BufferPool()  # masks and intermediate images reused every frame
+
+    def set_roi(self, roi):
+        self.roi = roi
+
+    def set_local_search(self, enabled, margin=None):
+        self.local_search = enabled
+        if margin is not None:
+            self.search_margin = margin
+
+    # returns the part of the frame the tracker works on and where it sits in the full frame
+    def crop(self, frame):
+        if self.roi is None:
+            return frame, (0, 0)
+        x, y, w, h = self.roi
+        x = min(max(x, 0), frame.shape[1] - 1)
+        y = min(max(y, 0), frame.shape[0] - 1)
+        return frame[y:y + h, x:x + w], (x, y)
+
+    # (x, y, w, h) around the last position sized from the size of the lock and the recent speed,
+    # None searches everywhere
+    def search_window(self):
+        if not self.local_search or not self.has_lock or self.last_pos is None:
+            return None
+        half = int(self.last_radius + self.search_margin + self.search_lead * max(self.steps, default=0))
+        x, y = int(self.last_pos[0]), int(self.last_pos[1])
+        return x - half, y - half, 2 * half, 2 * half
+
+    # rows and columns (y0, y1, x0, x1) of the search window in an image of shape that sits at offset
+    # in the full frame, scale is the size of the image relative to the full frame. None is the whole image
+    def search_slice(self, shape, offset, scale=1):
+        window = self.search_window()
+        if window is None:
+            return None
+        x0 = max(int((window[0] - offset[0]) * scale), 0)
+        y0 = max(int((window[1] - offset[1]) * scale), 0)
+        x1 = min(int((window[0] + window[2] - offset[0]) * scale), shape[1])
+        y1 = min(int((window[1] + window[3] - offset[1]) * scale), shape[0])
+        if x1 <= x0 or y1 <= y0:  # window is outside of the region of interest
+            return None
+        return y0, y1, x0, x1
+
+    # narrows an image that sits at offset in the full frame down to the search window
+    def search_region(self, image, offset, scale=1):
+        window = self.search_slice(image.shape, offset, scale)
+        if window is None:
+            return image, offset
+        y0, y1, x0, x1 = window
+        return image[y0:y1, x0:x1], (offset[0] + x0 / scale, offset[1] + y0 / scale)
+
+    # pool buffer of shape narrowed to a search_slice window, None when buffers are off
+    def window_buffer(self, name, shape, window):
+        buffer = self.buffers.get(name, shape)
+        if buffer is None or window is None:
+            return buffer
+        y0, y1, x0, x1 = window
+        return buffer[y0:y1, x0:x1]
+
+    def set_scale(self, scale):
+        self.scale = scale
+
+    # shrinks an image down to the processing scale
+    def shrink(self, image):
+        if self.scale == 1:
+            return image
+        shape = (int(round(image.shape[0] * self.scale)), int(round(image.shape[1] * self.scale))) + image.shape[2:]
+        return cv2.resize(image, None, dst=self.buffers.get('small', shape),
+                          fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+
+    def find_contours(self):
+        cnts = cv2.findContours(self.mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        return imutils.grab_contours(cnts)
+
+    # maps a contour from the processed mask to full frame pixels
+    def to_frame(self, contour):
+        if self.scale == 1:
+            return contour + np.int32(self.offset)
+        return np.int32(np.round((contour + 0.5) / self.scale - 0.5 + self.offset))
+
+    # (x, y, w, h) of the processed region in full frame pixels, clipped to the frame
+    def processed_rect(self, shape):
+        x, y = int(round(self.offset[0])), int(round(self.offset[1]))
+        h, w = self.mask.shape[:2]
+        w = min(int(round(w / self.scale)), shape[1] - x)
+        h = min(int(round(h / self.scale)), shape[0] - y)
+        return x, y, w, h
+
+    # remembers where the lock was so the next search window can follow it
+    def track_position(self):
+        if not self.has_lock:
+            self.last_pos = None
+            self.last_radius = 0
+            self.step = (0, 0)
+            self.steps.clear()
+            return
+        if self.contour is not None:
+            w, h = cv2.boundingRect(self.contour)[2:]
+            self.last_radius = math.hypot(w, h) / 2
+        if self.last_pos is not None:
+            self.step = (self.position[0] - self.last_pos[0], self.position[1] - self.last_pos[1])
+            self.steps.append(self.calc_distance(self.last_pos, self.position))
+        self.last_pos = self.position
+
+    # start and tip of an arrow showing where the lock is heading, for drawing.
+    # the speeds of a whole run come from source.analytics
+    def velocity_arrow(self):
+        x, y = self.position
+        return (int(x), int(y)), (int(x + self.step[0] * self.arrow_lead), int(y + self.step[1] * self.arrow_lead))
 
+    @staticmethod
+    def calc_distance(pt1, pt2):
+        dist = math.sqrt((pt2[0] - pt1[0]) ** 2 + (pt2[1] - pt1[1]) ** 2)
+        return dist
 
-class TrackerHSV(PCA):
+    # draws the lock onto a copy of the frame update was given, only done for the overlay being shown
+    def draw(self, output):
+        self.draw_roi(output)
+
+    # outlines the region that was searched this frame
+    def draw_roi(self, output):
+        if self.roi is not None or self.local_search:
+            x, y, w, h = self.processed_rect(output.shape)
+            cv2.rectangle(output, (x, y), (x + w, y + h), (255, 0, 0), 1)
+
+    # blends the mask into its region of the frame
+    def mask_overlay(self, frame):
+        x, y, w, h = self.processed_rect(frame.shape)
+        mask = self.mask
+        if mask.shape[:2] != (h, w):
+            mask = cv2.resize(mask, (w, h), dst=self.buffers.get('overlay mask', (h, w)),
+                              interpolation=cv2.INTER_NEAREST)
+        output = self.buffers.copy('overlay', frame)
+        mask = cv2.cvtColor(mask, cv2.COLOR_GRAY2BGR, dst=self.buffers.get('overlay mask bgr', (h, w, 3)))
+        output[y:y + h, x:x + w] = cv2.addWeighted(output[y:y + h, x:x + w], .5, mask, .5, 0,
+                                                   dst=output[y:y + h, x:x + w])
+        return output
+
+
+class TrackerHSV(Tracker):
     def __init__(self):
         super().__init__()
-        self.output = None
-        self.mask = None
-        self.has_lock = False
 
         self.color_ranges = {'low_h': 0,
                              'low_s': 0,
@@ -103,37 +324,87 @@ class TrackerHSV(PCA):
                              'high_h': 255,
                              'high_s': 255,
                              'high_v': 255}
+        self.untimed = profiling.StageTimer()  # never enabled, for threshold calls that aren't timed by stage
 
+    # finds the ant in the frame, the frame isn't drawn on so it doesn't need to be copied
     def update(self, frame):
-        self.output = frame.copy()
-        blurred = cv2.GaussianBlur(self.output, (11, 11), 0)
-        hsv = cv2.cvtColor(blurred, cv2.COLOR_BGR2HSV)
-
-        # self.set_mask_ranges()
-        # create the bitwise masks
-        self.mask = cv2.inRange(hsv, self.color_low, self.color_high)
-        self.mask = cv2.erode(self.mask, None, iterations=1)
-        self.mask = cv2.dilate(self.mask, None, iterations=1)
+        t = time.perf_counter()
+        region, self.offset = self.search_region(*self.crop(frame))
+        self.has_lock = False
+        self.contour = None
+        region = self.shrink(region)
+        t = self.timer.lap('resize', t)
+        self.mask = self.threshold(region, self.scale)
+        t = time.perf_counter()
 
         # find contours in the mask and initialize the current
         # (x, y) center of the ball
-        cnts = cv2.findContours(self.mask.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        cnts = imutils.grab_contours(cnts)
+        cnts = self.find_contours()
 
         if len(cnts) > 0:
             self.has_lock = True
             # find the largest contour in the mask, then use
-            c = max(cnts, key=cv2.contourArea)
+            c = self.to_frame(max(cnts, key=cv2.contourArea))
+            t = self.timer.lap('contours', t)
+            if self.scale != 1:
+                c = self.refine(frame, c)
+                t = self.timer.lap('refine', t)
+            self.contour = c
+
+            self.locate(c, frame.shape[:2])
+            self.timer.lap('pca', t)
+        else:
+            self.timer.lap('contours', t)
 
-            super().calculate(super().contour_to_mask(c, self.mask.shape))
+        self.track_position()
 
+    def draw(self, output):
+        if self.has_lock:
             red = (0, 0, 255)
 
-            # cv2.drawContours(self.mask, [c], -1, (0, 255, 0), 1)
-            cv2.arrowedLine(self.output, tuple(super().velocity[0]), tuple(super().velocity[1]), red, 2)
-            cv2.polylines(self.output, [super().get_rectangle()], 1, red, 1)
+            # cv2.drawContours(self.mask, [self.contour], -1, (0, 255, 0), 1)
+            cv2.arrowedLine(output, *self.velocity_arrow(), red, 2)
+            cv2.polylines(output, [self.get_rectangle()], 1, red, 1)
+        self.draw_roi(output)
+
+    # bitwise mask of the pixels in the color range, scale keeps the blur the same size in the full frame.
+    # name keeps the buffers of different callers apart, timed records the blur, mask and morphology stages
+    def threshold(self, image, scale=1, name='mask', timed=True):
+        timer = self.timer if timed else self.untimed
+        t = time.perf_counter()
+        blur_size = max(int(11 * scale) // 2 * 2 + 1, 3)
+        blurred = cv2.GaussianBlur(image, (blur_size, blur_size), 0,
+                                   dst=self.buffers.get(name + ' blur', image.shape))
+        t = timer.lap('blur', t)
+        hsv = cv2.cvtColor(blurred, cv2.COLOR_BGR2HSV, dst=self.buffers.get(name + ' hsv', image.shape))
 
-        return self.output
+        # self.set_mask_ranges()
+        # create the bitwise masks
+        mask = cv2.inRange(hsv, self.color_low, self.color_high, dst=self.buffers.get(name, image.shape[:2]))
+        t = timer.lap('mask', t)
+        if scale < 1:
+            # at a quarter size the ant is only a few pixels wide and a 3x3 erode wipes it out,
+            # refine cleans the mask up at full resolution instead
+            return mask
+        eroded = cv2.erode(mask, None, dst=self.buffers.get(name + ' eroded', image.shape[:2]), iterations=1)
+        mask = cv2.dilate(eroded, None, dst=mask, iterations=1)
+        timer.lap('morphology', t)
+        return mask
+
+    # redoes the mask at full resolution inside the bounding box of a contour found at a smaller scale
+    def refine(self, frame, contour):
+        pad = int(math.ceil(1 / self.scale)) + 5  # room for the blur and for the rounding of the small mask
+        x, y, w, h = cv2.boundingRect(contour)
+        x0, y0 = max(x - pad, 0), max(y - pad, 0)
+        x1, y1 = min(x + w + pad, frame.shape[1]), min(y + h + pad, frame.shape[0])
+        # timed as a whole by update, so the stages of the small mask aren't mixed with these
+        cnts = cv2.findContours(self.threshold(frame[y0:y1, x0:x1], name='refine', timed=False), cv2.RETR_EXTERNAL,
+                                cv2.CHAIN_APPROX_SIMPLE,
+                                offset=(x0, y0))
+        cnts = imutils.grab_contours(cnts)
+        if len(cnts) == 0:
+            return contour
+        return max(cnts, key=cv2.contourArea)
 
     def set_mask_ranges(self):
         print(self.color_ranges)
@@ -145,24 +416,34 @@ class TrackerHSV(PCA):
                            self.color_ranges['high_v'],)
 
 
-class TrackerMotion(PCA):
+class TrackerMotion(Tracker):
     def __init__(self):
         super().__init__()
         self.motion_filter = cv2.createBackgroundSubtractorKNN(detectShadows=False)
-        self.has_lock = False
-        self.mask = None
-        self.result = None
+        self.candidates = []  # every contour big enough to be the ant, in full frame coordinates
         self.min_area = 100
         self.pos = (0, 0)
 
+    # finds the moving object closest to the last one, the frame isn't drawn on so it doesn't need to be copied
     def update(self, frame):
-        self.result = frame.copy()
-        self.mask = self.motion_filter.apply(frame)
-        self.mask = cv2.erode(self.mask, None, iterations=1)
-        self.mask = cv2.dilate(self.mask, None, iterations=1)
-
-        cnts = cv2.findContours(self.mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        cnts = imutils.grab_contours(cnts)
+        t = time.perf_counter()
+        region, offset = self.crop(frame)
+        region = self.shrink(region)
+        t = self.timer.lap('resize', t)
+        # the background model has to see the whole region every frame, only the contour search is local
+        foreground = self.motion_filter.apply(region, fgmask=self.buffers.get('foreground', region.shape[:2]))
+        window = self.search_slice(foreground.shape, offset, self.scale)
+        mask, self.offset = self.search_region(foreground, offset, self.scale)
+        t = self.timer.lap('mask', t)
+        # the window changes size nearly every frame, so the buffers are kept at the region's size
+        # and written through a view of the window
+        eroded = self.window_buffer('eroded', foreground.shape, window)
+        eroded = cv2.erode(mask, None, dst=eroded, iterations=1)
+        self.mask = cv2.dilate(eroded, None, dst=self.window_buffer('mask', foreground.shape, window), iterations=1)
+        t = self.timer.lap('morphology', t)
+
+        cnts = self.find_contours()
+        min_area = self.min_area * self.scale ** 2  # min_area is in full frame pixels
 
         valid_cnts = []
         best_cnt = None
@@ -171,8 +452,9 @@ class TrackerMotion(PCA):
         self.has_lock = False
 
         for c in cnts:
-            if cv2.contourArea(c) < self.min_area:  # skip objects that are probably noise
+            if cv2.contourArea(c) < min_area:  # skip objects that are probably noise
                 continue
+            c = self.to_frame(c)
             valid_cnts.append(c)
 
             M = cv2.moments(c)
@@ -187,48 +469,144 @@ class TrackerMotion(PCA):
                 best_pos = (cX, cY)
 
         self.pos = best_pos
+        self.candidates = valid_cnts
+        t = self.timer.lap('contours', t)
+
+        self.contour = best_cnt
+        if best_cnt is not None:
+            self.has_lock = True
+            self.locate(best_cnt, frame.shape[:2])
+            self.timer.lap('pca', t)
 
+        self.track_position()
+
+    def draw(self, output):
         red = (0, 0, 255)
         green = (0, 255, 0)
         blue = (255, 0, 0)
 
-        if best_cnt is not None:
-            self.has_lock = True
-            for c in valid_cnts:
+        if self.has_lock:
+            for c in self.candidates:
                 (x, y, w, h) = cv2.boundingRect(c)
                 rect_color = red
-                if c is best_cnt:
+                if c is self.contour:
                     rect_color = green
-                # cv2.rectangle(self.result, (x, y), (x + w, y + h), rect_color, 2)
-
-            super().calculate(super().contour_to_mask(best_cnt, self.mask.shape))
-            # cv2.arrowedLine(self.result, tuple(super().velocity[0]), tuple(super().velocity[1]), red, 2)
-            cv2.polylines(self.result, [super().get_rectangle()], 1, green, 2)
+                # cv2.rectangle(output, (x, y), (x + w, y + h), rect_color, 2)
 
-        return self.result
+            # cv2.arrowedLine(output, *self.velocity_arrow(), red, 2)
+            cv2.polylines(output, [self.get_rectangle()], 1, green, 2)
+        self.draw_roi(output)
 
     def set_filter_thresh(self, thresh):
         self.min_area = thresh
 
-    @staticmethod
-    def calc_distance(pt1, pt2):
-        dist = math.sqrt((pt2[0] - pt1[0]) ** 2 + (pt2[1] - pt1[1]) ** 2)
-        return dist
+    def set_roi(self, roi):
+        super().set_roi(roi)
+        # the background model is per pixel, so it has to be relearned for a new region
+        self.motion_filter = cv2.createBackgroundSubtractorKNN(detectShadows=False)
+
+
+# encodes a video on its own thread so a slow codec never holds up capture or the Tk loop.
+# frames are copied into a fixed set of buffers, when they're all waiting to be written the frame is dropped
+class VideoRecorder:
+    def __init__(self, path, framerate, size, fourcc='XVID', queue_size=32):
+        self.path = path
+        self.writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), framerate, size)
+        self.frame_queue = queue.Queue()
+        self.free = queue.Queue()  # buffers that aren't waiting to be written
+        self.queue_size = queue_size
+        self.buffer_count = 0
+        self.rgb = None
+
+        self.frames_queued = 0  # frames handed to the writer, the next one queued is this frame of the clip
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.max_depth = 0
+
+        self.thread = threading.Thread(target=self.write_frames, daemon=True)
+        self.thread.start()
+
+    @property
+    def queue_depth(self):
+        return self.frame_queue.qsize()
+
+    # hands a frame to the writer thread, returns False if it had to be dropped.
+    # block waits for a buffer to free up instead, for when every frame has to be kept
+    def write(self, frame, block=False):
+        try:
+            buffer = self.free.get_nowait()
+        except queue.Empty:
+            if self.buffer_count < self.queue_size:
+                buffer = np.empty_like(frame)
+                self.buffer_count += 1
+            elif block:
+                buffer = self.free.get()
+            else:
+                self.frames_dropped += 1
+                return False
+        if buffer.shape != frame.shape:
+            buffer = np.empty_like(frame)
+        np.copyto(buffer, frame)
+        self.frame_queue.put(buffer)
+        self.frames_queued += 1
+        self.max_depth = max(self.max_depth, self.queue_depth)
+        return True
+
+    def write_frames(self):
+        while True:
+            frame = self.frame_queue.get()
+            if frame is None:
+                break
+            # clips are stored as rgb, ViewClipWindow shows them without converting
+            self.rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=self.rgb)
+            self.writer.write(self.rgb)
+            self.frames_written += 1
+            self.free.put(frame)
+
+    # writes whatever is still queued, then closes the file
+    def close(self):
+        self.frame_queue.put(None)
+        self.thread.join()
+        self.writer.release()
+
+    def stats(self):
+        return {'frames_written': self.frames_written,
+                'frames_dropped': self.frames_dropped,
+                'queue_depth': self.queue_depth,
+                'max_queue_depth': self.max_depth}
 
 
 class VideoCapture:
-    def __init__(self, source, side, speed=1, flip=False):
-        self.vid = cv2.VideoCapture(source)
+    # open_async opens the source on a background thread, update returns None until it's open
+    def __init__(self, source, side, speed=1, flip=False, queue_size=2, open_async=False):
+        self.vid = cv2.VideoCapture()  # nothing opened yet
         self.side = side
+        self.speed = speed
         self.flip = flip
 
-        self.save_video = None
-        self.framerate = self.vid.get(cv2.CAP_PROP_FPS)
-        if self.framerate == 0:
-            self.framerate = 24
+        # frames are read on a background thread so a slow device never blocks the Tk loop
+        self.frame_queue = queue.Queue(maxsize=queue_size)
+        self.reader = None
+        self.reading = False
+        self.drop_oldest = not isinstance(source, str)  # live sources drop stale frames, files wait for the consumer
+        self.frames_read = 0
+        self.frames_dropped = 0
+        self.frame_idx = -1  # number of the current frame counted from when the capture was made
+        self.timestamp = 0.0  # wall clock time the current frame was read from the source
+
+        # timings of the tracking, overlay and display stages, see enable_profiling and profile
+        self.timer = profiling.StageTimer()
+        self.show_stats = False  # draw the achieved fps and stage times on the shown frame
+
+        self.recorder = None
+        self.clip_frame = -1  # frame of the recording the current frame went to, -1 if it was dropped
+        self.record_overlay = 'tracked'  # 'original' records the raw frames, see source.render for annotating them
+        self.framerate = 24
         self.refresh_period = int(1000 / speed / self.framerate)
-        self.width = self.vid.get(cv2.CAP_PROP_FRAME_WIDTH)
-        self.height = self.vid.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        self.width = 0
+        self.height = 0
+        self.generation = 0  # bumped by every open so a slow open that was replaced is thrown away
+        self.opened_at = None  # perf_counter time the source finished opening
 
         self.use_tracker = 'none'
         self.trackers = {'none': None,
@@ -237,9 +615,28 @@ class VideoCapture:
 
         self.name_idx = 0
         self.frame_names = ['original', 'tracked', 'mask']
-        self.frame = {}
-        for name in self.frame_names:
-            self.frame[name] = None
+        self.frame = {}  # overlays of the current frame, only the ones that were asked for get drawn
+        self.buffers = BufferPool()  # overlay and display frames reused every frame
+
+        if open_async:
+            threading.Thread(target=self.open, args=(source, self.generation), daemon=True).start()
+        else:
+            self.open(source, self.generation)
+
+    # a missing device can take seconds to give up on, which is why this can run on its own thread
+    def open(self, source, generation):
+        vid = cv2.VideoCapture(source)
+        if generation != self.generation:  # the source was changed while this one was opening
+            vid.release()
+            return
+        framerate = vid.get(cv2.CAP_PROP_FPS)
+        self.framerate = 24 if framerate == 0 else framerate
+        self.refresh_period = int(1000 / self.speed / self.framerate)
+        self.width = vid.get(cv2.CAP_PROP_FRAME_WIDTH)
+        self.height = vid.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        self.vid = vid
+        self.opened_at = time.perf_counter()
+        self.start_reader()
 
     @property
     def cur_tracker(self):
@@ -247,7 +644,24 @@ class VideoCapture:
 
     @property
     def cur_overlay(self):
-        return self.frame[self.use_overlay]
+        return self.overlay(self.use_overlay)
+
+    # the current frame drawn as one of frame_names, built the first time it's asked for
+    def overlay(self, name):
+        if name not in self.frame:
+            self.frame[name] = self.render(name)
+        return self.frame[name]
+
+    def render(self, name):
+        frame = self.frame['original']
+        if self.cur_tracker is None or name == 'original':
+            return frame
+        if name == 'tracked':
+            output = self.buffers.copy('tracked', frame)
+        elif name == 'mask':
+            output = self.cur_tracker.mask_overlay(frame)
+        self.cur_tracker.draw(output)
+        return output
 
     @property
     def use_overlay(self):
@@ -257,12 +671,164 @@ class VideoCapture:
     def use_overlay(self, name):
         self.name_idx = self.frame_names.index(name)
 
+    def set_roi(self, roi):
+        for tracker in self.trackers.values():
+            if tracker is not None:
+                tracker.set_roi(roi)
+
+    def set_scale(self, name, scale):
+        self.trackers[name].set_scale(scale)
+
+    def set_local_search(self, enabled, margin=None):
+        for tracker in self.trackers.values():
+            if tracker is not None:
+                tracker.set_local_search(enabled, margin)
+
+    # turns the reuse of frame buffers on or off for this camera and its trackers
+    def set_buffer_reuse(self, enabled):
+        self.buffers.enabled = enabled
+        self.buffers.clear()
+        for tracker in self.trackers.values():
+            if tracker is not None:
+                tracker.buffers.enabled = enabled
+                tracker.buffers.clear()
+
     def cycle_overlay(self):
         self.name_idx = (self.name_idx + 1) % len(self.frame_names)
 
+    def enable_profiling(self, enabled):
+        self.timer.enabled = enabled
+        for tracker in self.trackers.values():
+            if tracker is not None:
+                tracker.timer.enabled = enabled
+        if not enabled:
+            self.timer.reset()
+
+    # the stats overlay needs the timings so it turns profiling on with it
+    def set_show_stats(self, show):
+        self.show_stats = show
+        if show:
+            self.enable_profiling(True)
+
+    # rolling timings of every stage a frame goes through, from the capture to the tk label
+    #   stages: read (time spent in the queue), track, overlay, get_frame, resize, display
+    #   tracker: the stages inside the current tracker's update
+    def profile(self):
+        return {'fps': self.timer.rate('frame'),
+                'source_fps': self.framerate,
+                'frames_read': self.frames_read,
+                'frames_dropped': self.frames_dropped,
+                'queue_depth': self.queue_depth,
+                'recording': None if self.recorder is None else self.recorder.stats(),
+                'stages': self.timer.stats(),
+                'tracker': {} if self.cur_tracker is None else self.cur_tracker.timer.stats()}
+
+    def draw_stats(self, output):
+        lines = ['{:.1f} / {:.1f} fps'.format(self.timer.rate('frame'), self.framerate),
+                 'read {:.1f} ms'.format(self.timer.mean_ms('read')),
+                 'track {:.1f} ms'.format(self.timer.mean_ms('track') + self.timer.mean_ms('overlay')),
+                 'show {:.1f} ms'.format(self.timer.mean_ms('get_frame') + self.timer.mean_ms('resize') +
+                                         self.timer.mean_ms('display'))]
+        for i in range(len(lines)):
+            cv2.putText(output, lines[i], (10, 25 + 22 * i), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 3)
+            cv2.putText(output, lines[i], (10, 25 + 22 * i), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 0), 1)
+
+    @property
+    def queue_depth(self):
+        return self.frame_queue.qsize()
+
+    def start_reader(self):
+        if not self.vid.isOpened():
+            return
+        self.reading = True
+        self.reader = threading.Thread(target=self.read_frames, daemon=True)
+        self.reader.start()
+
+    def stop_reader(self):
+        self.reading = False
+        if self.reader is not None:
+            self.clear_queue()  # unblock a reader waiting on a full queue
+            self.reader.join()
+            self.reader = None
+        self.clear_queue()
+
+    def clear_queue(self):
+        while True:
+            try:
+                self.frame_queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def read_frames(self):
+        while self.reading:
+            ret, frame = self.vid.read()
+            if not ret:
+                if not self.drop_oldest:
+                    break  # end of the file
+                # a live camera that missed a frame usually has the next one, keep trying like refresh used to
+                time.sleep(0.01)
+                continue
+            item = (self.frames_read, time.time(), frame)
+            self.frames_read += 1
+            if self.drop_oldest:
+                while True:
+                    try:
+                        self.frame_queue.put_nowait(item)
+                        break
+                    except queue.Full:
+                        try:
+                            self.frame_queue.get_nowait()
+                            self.frames_dropped += 1
+                        except queue.Empty:
+                            pass
+            else:
+                while self.reading:
+                    try:
+                        self.frame_queue.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+        self.reading = False
+
+    # (frame number, timestamp, frame) of the next frame to show, None if nothing new was read
+    def next_frame(self):
+        try:
+            item = self.frame_queue.get_nowait()
+        except queue.Empty:
+            return None
+        if self.drop_oldest:
+            # skip ahead to the newest frame so the display never falls behind the source
+            while True:
+                try:
+                    item = self.frame_queue.get_nowait()
+                    self.frames_dropped += 1
+                except queue.Empty:
+                    break
+        return item
+
+    # every frame read since the last call, file sources hand over one at a time since they wait for the consumer
+    def take_frames(self):
+        items = []
+        while True:
+            try:
+                items.append(self.frame_queue.get_nowait())
+            except queue.Empty:
+                return items
+            if not self.drop_oldest:
+                return items
+
+    # still has frames to give
+    @property
+    def active(self):
+        return self.vid.isOpened() and (self.reading or not self.frame_queue.empty())
+
     def change_source(self, source):
+        self.stop_reader()
         self.vid.release()
+        self.generation += 1  # a startup open still running for the old source is dropped
         self.vid = cv2.VideoCapture(source)
+        self.drop_oldest = not isinstance(source, str)
+        self.set_buffer_reuse(self.buffers.enabled)  # the new source can have a different resolution
         # if isinstance(source, str):
         #     self.vid = cv2.VideoCapture(source)
         # else:
@@ -273,49 +839,77 @@ class VideoCapture:
             self.vid.release()
         else:
             self.refresh_period = int(1000 / self.framerate)
+            self.width = self.vid.get(cv2.CAP_PROP_FRAME_WIDTH)
+            self.height = self.vid.get(cv2.CAP_PROP_FRAME_HEIGHT)
+            self.start_reader()
+        self.opened_at = time.perf_counter()
 
     def update(self):
         if not self.vid.isOpened():
             return None
-        ret, frame = self.vid.read()
-        if not ret:
-            print('Video Done')
+        item = self.next_frame()
+        if item is None:
+            if not self.reading:
+                print('Video Done')
             # self.vid.set(cv2.CAP_PROP_POS_FRAMES, 0)
             return None
-
-        self.frame['original'] = frame
-
-        if self.use_tracker == 'none':
-            self.frame['tracked'] = frame
-            self.frame['mask'] = frame
-        else:
-            self.frame['tracked'] = self.cur_tracker.update(frame)
-            self.frame['mask'] = cv2.addWeighted(self.frame['tracked'], .5,
-                                                 cv2.cvtColor(self.cur_tracker.mask,
-                                                              cv2.COLOR_GRAY2BGR), .5, 0)
+        return self.process(item)
+
+    # runs the tracker and builds the overlays for a (frame number, timestamp, frame) from the reader
+    def process(self, item):
+        self.frame_idx, self.timestamp, frame = item
+        self.timer.record('read', time.time() - self.timestamp)
+        self.timer.tick('frame')
+
+        t = time.perf_counter()
+        self.frame = {'original': frame}
+        if self.cur_tracker is not None:
+            self.cur_tracker.update(frame)
+            t = self.timer.lap('track', t)
+            # drawn here so it runs on the camera's thread, anything else is drawn if it's asked for
+            self.overlay(self.use_overlay)
+            self.timer.lap('overlay', t)
+        if self.recorder is not None:
+            self.capture_frame()
         return True
 
     def has_track(self):
-        return self.cur_tracker.has_lock
+        return self.cur_tracker is not None and self.cur_tracker.has_lock
 
     def get_frame(self):
+        t = time.perf_counter()
+        frame = self.cur_overlay
         if self.flip:
-            return cv2.cvtColor(cv2.flip(self.cur_overlay, 1), cv2.COLOR_BGR2RGB)
-        else:
-            return cv2.cvtColor(self.cur_overlay, cv2.COLOR_BGR2RGB)
+            frame = cv2.flip(frame, 1, dst=self.buffers.get('flipped', frame.shape))
+        # the returned frame is overwritten by the next call, it has to be shown or copied before then
+        output = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=self.buffers.get('rgb', frame.shape))
+        self.timer.lap('get_frame', t)
+        if self.show_stats:
+            self.draw_stats(output)
+        return output
 
 
-    def start_record(self, video_name):
-        fourcc = cv2.VideoWriter_fourcc(*'XVID')
+    # raw recordings skip the drawing and use a codec that is cheap to encode
+    def start_record(self, video_name, raw=False, raw_codec='MJPG'):
         video_name = r'..\\clips\\' + video_name + '.avi'
-        self.save_video = cv2.VideoWriter(video_name, fourcc, self.framerate,
-                                          (int(self.width), int(self.height)))
+        self.record_overlay = 'original' if raw else 'tracked'
+        self.recorder = VideoRecorder(video_name, self.framerate, (int(self.width), int(self.height)),
+                                      fourcc=raw_codec if raw else 'XVID')
 
     def stop_record(self):
-        self.save_video.release()
-
+        if self.recorder is None:
+            return
+        self.recorder.close()
+        print(self.side, 'recording:', self.recorder.stats())
+        self.recorder = None
+
+    # every processed frame of this camera is queued for the recording once, from process.
+    # the frame number it got in the clip is kept for the trajectory sample of this frame
     def capture_frame(self):
-        self.save_video.write(cv2.cvtColor(self.frame['tracked'], cv2.COLOR_BGR2RGB))
+        if self.recorder.write(self.overlay(self.record_overlay)):
+            self.clip_frame = self.recorder.frames_queued - 1
+        else:
+            self.clip_frame = -1
 
     def generate_vid_name(self, data_log):
         date_name = datetime.today().strftime('%m-%d-%Y')
@@ -333,29 +927,146 @@ class VideoCapture:
 
     # Release the video source when the object is destroyed
     def __del__(self):
+        self.stop_reader()
         if self.vid.isOpened():
             self.vid.release()
 
 
+# ticks any number of cameras together: frames are paired by capture time and every camera
+# runs its tracker at the same time on its own thread, opencv lets go of the GIL while it works
+class CameraGroup:
+    def __init__(self, videos, history=8, stall_time=0.5):
+        self.videos = list(videos)
+        self.history = [deque(maxlen=history) for _ in self.videos]  # frames read but not used yet
+        self.last_seen = [0.0] * len(self.videos)  # when each camera last gave a frame
+        self.stall_time = stall_time  # seconds a camera can go without frames before the others stop waiting
+        self.pool = ThreadPoolExecutor(max_workers=max(len(self.videos), 1))
+
+        self.tick = -1  # number of the last tick, the frame number shared by every camera
+        self.timestamp = 0.0  # capture time the frames of the last tick were paired on
+        self.updated = []  # cameras that got a new frame on the last tick
+        self.unpaired = 0  # ticks where the frames were further apart than the tolerance
+
+    # frames further apart than this are still used together, but counted in unpaired
+    @property
+    def tolerance(self):
+        rates = [video.framerate for video in self.videos if video.framerate > 0]
+        if len(rates) == 0:
+            return 0
+        return 0.5 / min(rates)  # half the period of the slowest camera
+
+    @property
+    def refresh_period(self):
+        periods = [video.refresh_period for video in self.videos if video.vid.isOpened()]
+        if len(periods) == 0:
+            return min(video.refresh_period for video in self.videos)
+        return min(periods)
+
+    # forgets frames of a camera, for when its source changes
+    def clear(self, video):
+        self.history[self.videos.index(video)].clear()
+
+    def update(self):
+        now = time.time()
+        ready = []
+        for i in range(len(self.videos)):
+            video = self.videos[i]
+            if video.vid.isOpened():
+                items = video.take_frames()
+                if len(items) > 0:
+                    self.last_seen[i] = now
+                self.history[i].extend(items)
+            if len(self.history[i]) > 0:
+                ready.append(i)
+            elif video.active and now - self.last_seen[i] < self.stall_time:
+                return None  # wait for this camera to catch up so its frame can be paired
+
+        if len(ready) == 0:
+            return None
+
+        # pair on the newest time every camera has reached, taking each camera's closest frame to it
+        reference = min(self.history[i][-1][1] for i in ready)
+        chosen = {}
+        for i in ready:
+            chosen[i] = min(self.history[i], key=lambda item: abs(item[1] - reference))
+            while len(self.history[i]) > 0 and self.history[i][0][0] <= chosen[i][0]:
+                if self.history[i].popleft() is not chosen[i]:
+                    self.videos[i].frames_dropped += 1
+        times = [chosen[i][1] for i in ready]
+        if max(times) - min(times) > self.tolerance:
+            self.unpaired += 1
+
+        list(self.pool.map(lambda i: self.videos[i].process(chosen[i]), ready))
+        self.tick += 1
+        self.timestamp = reference
+        self.updated = [self.videos[i] for i in ready]
+        return True
+
+    def close(self):
+        self.pool.shutdown()
+
+
+# random access to a recorded clip for reviewing it: frames that were shown recently come from a cache,
+# short jumps forward are decoded and longer jumps seek
 class VideoPlayback:
-    def __init__(self, name):
+    def __init__(self, name, cache_mb=256, max_decode_ahead=48):
         url = r'..\\clips\\' + name + '.avi'
         self.vid = cv2.VideoCapture(url)
         self.framerate = self.vid.get(cv2.CAP_PROP_FPS)
         if self.framerate == 0:
             self.framerate = 1
         self.refresh_period = int(1000 / self.framerate)
+        self.frame_count = int(self.vid.get(cv2.CAP_PROP_FRAME_COUNT))
 
+        self.cache = OrderedDict()  # frame number -> frame, least recently used first
+        self.cache_bytes = cache_mb * 2 ** 20
+        self.max_decode_ahead = max_decode_ahead  # further than this a seek is faster than decoding up to it
+        self.next_idx = 0  # frame the decoder reads next
+        self.position = -1  # frame returned last
+
+    # the frame after the last one returned, None at the end
     def get_frame(self):
         if not self.vid.isOpened():
             print('Could not open video')
             return None
+        frame = self.read(self.position + 1)
+        if frame is None:
+            print('Cannot read video file')
+        return frame
+
+    def read(self, idx):
+        if idx < 0 or (self.frame_count > 0 and idx >= self.frame_count):
+            return None
+        if idx in self.cache:
+            self.cache.move_to_end(idx)
+            self.position = idx
+            return self.cache[idx]
+
+        if idx < self.next_idx or idx - self.next_idx > self.max_decode_ahead:
+            # the backend seeks to the keyframe before idx and decodes from there
+            self.vid.set(cv2.CAP_PROP_POS_FRAMES, idx)
+            self.next_idx = idx
+        while self.next_idx < idx:
+            if not self.vid.grab():
+                return None
+            self.next_idx += 1
         ret, frame = self.vid.read()
         if not ret:
-            print('Cannot read video file')
             return None
+        self.next_idx += 1
+        self.position = idx
+        self.remember(idx, frame)
         return frame
 
+    def remember(self, idx, frame):
+        self.cache[idx] = frame
+        while len(self.cache) * frame.nbytes > self.cache_bytes and len(self.cache) > 1:
+            self.cache.popitem(last=False)
+
+    def release(self):
+        self.cache.clear()
+        self.vid.release()
+
 
 if __name__ == '__main__':
     pass
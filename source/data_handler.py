@@ -1,117 +1,493 @@
 import json
-from datetime import datetime
-from collections import OrderedDict
+import sqlite3
+import time
+from datetime import datetime, timedelta
 import os
+import numpy as np
+from source import summary
+
+
+# one record per logged frame, stored as a .npy file per run
+TRAJECTORY_DTYPE = np.dtype([('frame', np.int64),
+                             ('timestamp', np.float64),
+                             ('x', np.float32),
+                             ('y', np.float32),
+                             ('angle', np.float32),
+                             ('clip_frame', np.int64)])  # frame of the camera's clip, -1 if the recorder dropped it
+
+# orders query_runs can sort by and the column each one sorts on
+RUN_ORDERS = {'started': 'e.started',
+              'id': 'e.id',
+              'duration': 's.duration',
+              'lock_pct': 's.lock_pct',
+              'path_length': 's.path_length'}
+
+
+# .npy file of a camera's trajectory for the entry in a row, camera 0 keeps the name from before there were two
+def trajectory_file(runs_path, row, camera=0):
+    if camera == 0:
+        return os.path.join(runs_path, '{}.npy'.format(row))
+    return os.path.join(runs_path, '{}_{}.npy'.format(row, camera))
+
+
+# sample index of every clip frame below frames, -1 for frames no sample was drawn on
+def frame_samples(samples, frames):
+    lookup = np.full(frames, -1, np.int64)
+    clip = np.asarray(samples['clip_frame'])
+    kept = (clip >= 0) & (clip < frames)
+    lookup[clip[kept]] = np.nonzero(kept)[0]
+    return lookup
+
+
+# samples of one camera while a run is recorded, streamed to a file in batches when it has one
+class TrajectoryBuffer:
+    def __init__(self, path, flush_size=256):
+        self.path = path
+        # samples not written to the file yet, preallocated so logging a frame doesn't allocate
+        self.flush_size = flush_size  # samples kept in memory before they are appended to the file
+        self.samples = np.zeros(self.flush_size, dtype=TRAJECTORY_DTYPE)
+        self.pending = 0  # number of rows of samples in use
+        self.count = 0  # samples logged in the current run
+        self.file = None
+
+    # starts streaming samples to the file instead of keeping them all in memory
+    def start(self):
+        self.close()
+        self.pending = 0
+        self.count = 0
+        self.file = open(self.path, 'wb')
+
+    def append(self, frame, timestamp, x, y, angle, clip_frame=-1):
+        if self.pending == len(self.samples):
+            if self.file is None:
+                self.samples = np.resize(self.samples, 2 * len(self.samples))  # not streaming, make room
+            else:
+                self.flush()
+        self.samples[self.pending] = (frame, timestamp, x, y, angle, clip_frame)
+        self.pending += 1
+        self.count += 1
+        if self.pending == self.flush_size:
+            self.flush()
+
+    def flush(self):
+        if self.file is None or self.pending == 0:
+            return
+        self.file.write(self.samples[:self.pending].tobytes())
+        # handed to the os so a crash of the app keeps it. no fsync, this runs on the tk thread
+        self.file.flush()
+        self.pending = 0
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def remove(self):
+        self.close()
+        self.pending = 0
+        self.count = 0
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    # everything recorded so far, a sample cut off by a crash is dropped
+    def read(self):
+        self.flush()
+        try:
+            with open(self.path, 'rb') as read_file:
+                data = read_file.read()
+        except FileNotFoundError:
+            data = b''
+        end = len(data) - len(data) % TRAJECTORY_DTYPE.itemsize
+        buffered = np.frombuffer(data[:end], dtype=TRAJECTORY_DTYPE)
+        if self.pending > 0:  # nothing was streamed, start wasn't called
+            buffered = np.concatenate([buffered, self.samples[:self.pending]])
+        return buffered
 
 
 class DataLog:
-    def __init__(self):
+    # read_only opens the log without setting it up or recovering a recording, for tools that run next to the app
+    def __init__(self, db_path=r'..\data\data_logs.db', json_path=r'..\data\data_logs.json',
+                 runs_path=r'..\data\runs', read_only=False):
         self.id = None
         self.note = ''
         self.url1 = ''
         self.url2 = ''
-        self.x = []
-        self.y = []
-        self.angle = []
 
-        self.entry = {}     # the entry to insert
+        # every entry is its own row and its trajectory is its own file,
+        # so saving, editing or deleting a run only touches that run
+        self.db_path = db_path
+        self.json_path = json_path  # the old single file log, imported once when the database is created
+        self.runs_path = runs_path
+        self.buffer_info_path = os.path.join(self.runs_path, 'recording.json')
+        self.buffers = []
+        if read_only:
+            self.db = sqlite3.connect('file:{}?mode=ro'.format(self.db_path), uri=True)
+            return
+        os.makedirs(self.runs_path, exist_ok=True)
+        is_new = not os.path.exists(self.db_path)
+        self.db = sqlite3.connect(self.db_path)
+        self.db.execute('PRAGMA foreign_keys = ON')
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.create_tables()
+        if is_new:
+            self.import_json()
+
+        # a recording is streamed to these while it runs, if they are still here the last session never saved
+        self.buffers = [TrajectoryBuffer(self.buffer_path(0))]  # one per camera, camera 0 is the main trajectory
+        self.recover()
+
+    def create_tables(self):
+        with self.db:
+            # started is a sortable 'YYYY-MM-DD HH:MM:SS' copy of date and time, the keys are month first.
+            # trajectory files are named by entry_id, autoincrement never hands a deleted one out again
+            self.db.execute('CREATE TABLE IF NOT EXISTS entries ('
+                            'entry_id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                            'date TEXT NOT NULL, '
+                            'time TEXT NOT NULL, '
+                            'id INTEGER NOT NULL, '
+                            'notes TEXT NOT NULL, '
+                            'url1 TEXT NOT NULL, '
+                            'url2 TEXT NOT NULL, '
+                            'started TEXT NOT NULL, '
+                            'UNIQUE (date, time))')
+            # worked out when an entry is saved so the navigator can show it without loading anything
+            self.db.execute('CREATE TABLE IF NOT EXISTS summaries ('
+                            'entry_id INTEGER PRIMARY KEY REFERENCES entries (entry_id) ON DELETE CASCADE, '
+                            'duration REAL NOT NULL, '
+                            'samples INTEGER NOT NULL, '
+                            'lock_pct REAL NOT NULL, '
+                            'path_length REAL NOT NULL, '
+                            'thumbnail BLOB, '
+                            'heatmap BLOB)')
+            # what query_runs filters and sorts on
+            self.db.execute('CREATE INDEX IF NOT EXISTS entries_started ON entries (started)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS entries_id ON entries (id)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS summaries_duration ON summaries (duration)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS summaries_lock_pct ON summaries (lock_pct)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS summaries_path_length ON summaries (path_length)')
+            self.create_notes_index()
+
+    # full text index of the notes, kept up to date by triggers. sqlite builds without fts5 search with LIKE instead
+    def create_notes_index(self):
+        try:
+            self.db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(notes, content = 'entries', "
+                            "content_rowid = 'entry_id')")
+        except sqlite3.OperationalError:
+            print('sqlite has no fts5, searching notes without an index')
+            return
+        self.db.execute('CREATE TRIGGER IF NOT EXISTS entries_insert_notes AFTER INSERT ON entries BEGIN '
+                        'INSERT INTO notes_fts (rowid, notes) VALUES (new.entry_id, new.notes); END')
+        self.db.execute('CREATE TRIGGER IF NOT EXISTS entries_delete_notes AFTER DELETE ON entries BEGIN '
+                        "INSERT INTO notes_fts (notes_fts, rowid, notes) VALUES ('delete', old.entry_id, old.notes); "
+                        'END')
+        self.db.execute('CREATE TRIGGER IF NOT EXISTS entries_update_notes AFTER UPDATE OF notes ON entries BEGIN '
+                        "INSERT INTO notes_fts (notes_fts, rowid, notes) VALUES ('delete', old.entry_id, old.notes); "
+                        'INSERT INTO notes_fts (rowid, notes) VALUES (new.entry_id, new.notes); END')
+
+    def has_notes_index(self):
+        return self.db.execute("SELECT name FROM sqlite_master WHERE name = 'notes_fts'").fetchone() is not None
+
+    def import_json(self):
+        try:
+            with open(self.json_path, 'r') as read_file:
+                data = json.load(read_file)
+        except (OSError, json.decoder.JSONDecodeError):
+            return
+
+        for date_key in data:
+            for time_key, entry in data[date_key].items():
+                try:
+                    x, y, angle = json.loads(entry['x']), json.loads(entry['y']), json.loads(entry['angle'])
+                except json.decoder.JSONDecodeError:
+                    print('Could not read the trajectory of', date_key, time_key)
+                    x, y, angle = [], [], []
+                # the old log has no frame numbers or timestamps. it took a sample every 4 refresh periods of the
+                # left camera, so the times are rebuilt from that. its clips were written on every tick of both
+                # cameras, so no sample can be tied to a clip frame
+                period = 4 * int(1000 / summary.clip_framerate(self.clip_path(entry['url1']))) / 1000
+                start = datetime.strptime(date_key + ' ' + time_key, '%m/%d/%Y %H:%M:%S').timestamp()
+                samples = [(i, start + i * period, x[i], y[i], angle[i], -1) for i in range(len(x))]
+                self.insert_entry(date_key, time_key, entry['id'], entry['notes'],
+                                  entry['url1'], entry['url2'], [samples])
+        print('imported', self.json_path)
+
+    # trajectories has one array of samples per camera
+    def insert_entry(self, date_key, time_key, entry_id, note, url1, url2, trajectories):
+        # the files are written inside the transaction so a failed write doesn't leave an entry behind
+        with self.db:
+            started = datetime.strptime(date_key + ' ' + time_key, '%m/%d/%Y %H:%M:%S')
+            cursor = self.db.execute('INSERT INTO entries (date, time, id, notes, url1, url2, started) '
+                                     'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                     (date_key, time_key, entry_id, note, url1, url2,
+                                      started.strftime('%Y-%m-%d %H:%M:%S')))
+            row = cursor.lastrowid
+            for camera in range(len(trajectories)):
+                self.write_trajectory(row, trajectories[camera], camera)
+            if len(trajectories) > 0:
+                self.insert_summary(row, np.array(trajectories[0], dtype=TRAJECTORY_DTYPE), url1)
+        return row
+
+    # summary of the main trajectory and the left clip of an entry
+    def insert_summary(self, row, samples, url1):
+        info = summary.summarize(samples, self.clip_path(url1))
+        self.db.execute('INSERT OR REPLACE INTO summaries '
+                        '(entry_id, duration, samples, lock_pct, path_length, thumbnail, heatmap) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (row, info['duration'], info['samples'], info['lock_pct'], info['path_length'],
+                         info['thumbnail'], info['heatmap']))
+
+    def clip_path(self, url):
+        return r'..\\clips\\' + url + '.avi'
+
+    # camera 0 keeps the plain <entry_id>.npy name so single camera runs look the same as before
+    def trajectory_path(self, row, camera=0):
+        return trajectory_file(self.runs_path, row, camera)
 
-        self.data = OrderedDict()      # all entries from the json file
-        self.json_path = r'..\data\data_logs.json'
+    # entry_id -> cameras with a trajectory file, from one listing of the runs folder.
+    # a missing file doesn't hide the cameras after it
+    def trajectory_files(self):
+        files = {}
+        for name in os.listdir(self.runs_path):
+            stem, ext = os.path.splitext(name)
+            row, _, camera = stem.partition('_')
+            if ext != '.npy' or not row.isdigit() or not (camera == '' or camera.isdigit()):
+                continue
+            files.setdefault(int(row), []).append(int(camera or 0))
+        for cameras in files.values():
+            cameras.sort()
+        return files
 
-        with open(self.json_path, 'r') as read_file:
-            try:
-                self.data = json.load(read_file)
-            except json.decoder.JSONDecodeError:  # if log file is empty, initialize it
-                print('Empty data file')
-                with open(self.json_path, "w") as write_file:
-                    json.dump(self.data, write_file)  # put the empty dictionary into the file
+    def trajectory_cameras(self, row):
+        return self.trajectory_files().get(row, [])
 
-        self.print_data()
+    def write_trajectory(self, row, samples, camera=0):
+        path = self.trajectory_path(row, camera)
+        with open(path + '.tmp', 'wb') as write_file:
+            np.save(write_file, np.array(samples, dtype=TRAJECTORY_DTYPE))
+        os.replace(path + '.tmp', path)  # never leave a half written file under the real name
+
+    def buffer_path(self, camera):
+        if camera == 0:
+            return os.path.join(self.runs_path, 'recording.partial')
+        return os.path.join(self.runs_path, 'recording_{}.partial'.format(camera))
+
+    # starts streaming samples to the recording buffers instead of keeping them all in memory
+    def start_recording(self, url1, url2, cameras=1):
+        for buffer in self.buffers:
+            buffer.close()
+        self.buffers = [TrajectoryBuffer(self.buffer_path(camera)) for camera in range(cameras)]
+        with open(self.buffer_info_path, 'w') as write_file:
+            json.dump({'url1': url1, 'url2': url2, 'started': time.time(), 'cameras': cameras}, write_file)
+        for buffer in self.buffers:
+            buffer.start()
+
+    def flush(self):
+        for buffer in self.buffers:
+            buffer.flush()
+
+    def remove_buffers(self):
+        for buffer in self.buffers:
+            buffer.remove()
+        if os.path.exists(self.buffer_info_path):
+            os.remove(self.buffer_info_path)
+
+    # saves a recording the last session didn't get to save
+    def recover(self):
+        if not os.path.exists(self.buffer_path(0)):
+            return None
+        try:
+            with open(self.buffer_info_path, 'r') as read_file:
+                info = json.load(read_file)
+        except (OSError, json.decoder.JSONDecodeError):
+            info = {'url1': '', 'url2': '', 'started': os.path.getmtime(self.buffer_path(0))}
+
+        self.buffers = [TrajectoryBuffer(self.buffer_path(camera)) for camera in range(info.get('cameras', 1))]
+        date_key, time_key = self.free_keys(datetime.fromtimestamp(info['started']))
+        self.insert_entry(date_key, time_key, self.generate_id(date_key), 'Recovered recording',
+                          info['url1'], info['url2'], [buffer.read() for buffer in self.buffers])
+        self.remove_buffers()
+        print('recovered recording from', date_key, time_key)
+        return date_key, time_key
+
+    # date and time keys for a new entry, moved on by a second if an entry already has them
+    def free_keys(self, moment):
+        while True:
+            date_key = moment.strftime('%m/%d/%Y')
+            time_key = moment.strftime('%H:%M:%S')
+            if self.get_entry(date_key, time_key) is None:
+                return date_key, time_key
+            moment += timedelta(seconds=1)
 
     # returns the date and time it was saved to
     def save_entry(self, note, url1, url2):
-        self.entry = {}
         self.note = note
         self.url1 = url1
         self.url2 = url2
-        now = datetime.now()
-        date_key = now.strftime('%m/%d/%Y')
-        time_key = now.strftime('%H:%M:%S')
-        self.entry['id'] = self.generate_id(date_key)   # self.generate_id(date_key)
-        self.entry['notes'] = self.note
-        self.entry['x'] = str(self.x)
-        self.entry['y'] = str(self.y)
-        self.entry['angle'] = str(self.angle)
-        self.entry['url1'] = self.url1
-        self.entry['url2'] = self.url2
+        date_key, time_key = self.free_keys(datetime.now())
+        self.id = self.generate_id(date_key)
+        self.insert_entry(date_key, time_key, self.id, self.note, self.url1, self.url2,
+                          [buffer.read() for buffer in self.buffers])
         # reset data arrays after it has been added to entry
-        self.x = []
-        self.y = []
-        self.angle = []
-        try:
-            self.data[date_key][time_key] = self.entry
-        except KeyError:  # if a dictionary hasn't been made inside the date_key entry
-            self.data[date_key] = {}
-            self.data[date_key][time_key] = self.entry
-
-        with open(self.json_path, "w") as write_file:
-            json.dump(self.data, write_file)
+        self.remove_buffers()
 
         print('entry added')
-        self.print_data()
 
         return date_key, time_key
 
-    def append_values(self, pos, angle):
-        self.x.append(pos[0])
-        self.y.append(pos[1])
-        self.angle.append(angle)
+    def discard_entry(self):
+        self.remove_buffers()
+
+    # clip_frame defaults to the sample's own number, for when every frame makes it into the clip
+    def append_values(self, pos, angle, frame=None, timestamp=None, camera=0, clip_frame=None):
+        buffer = self.buffers[camera]
+        if frame is None:
+            frame = buffer.count
+        if timestamp is None:
+            timestamp = time.time()
+        if clip_frame is None:
+            clip_frame = buffer.count
+        buffer.append(frame, timestamp, pos[0], pos[1], angle, clip_frame)
+
+    # one time aligned sample per camera, tracks is a (position, angle, clip frame) for each camera,
+    # or None for a camera that had no frame that tick. the clip frame is -1 if the recorder dropped it
+    def append_tick(self, frame, timestamp, tracks):
+        for camera in range(len(tracks)):
+            if tracks[camera] is None:
+                continue
+            position, angle, clip_frame = tracks[camera]
+            self.append_values(position, angle, frame, timestamp, camera, clip_frame)
 
     def print_data(self):
-        print(json.dumps(self.data, indent=4))
+        rows = self.db.execute('SELECT date, time, id, notes, url1, url2 FROM entries ORDER BY entry_id')
+        for row in rows:
+            print(row)
 
-    def get_dates(self):
-        return list(self.data.keys())
+    # where clause and parameters shared by query_runs and count_runs, see query_runs
+    def run_filter(self, start=None, end=None, min_lock=None, max_lock=None, min_duration=None, max_duration=None,
+                   text=None, run_id=None):
+        clauses = []
+        params = []
+        if start is not None:
+            clauses.append('e.started >= ?')
+            params.append(start.strftime('%Y-%m-%d'))
+        if end is not None:  # the whole end day is included
+            clauses.append('e.started < ?')
+            params.append((end + timedelta(days=1)).strftime('%Y-%m-%d'))
+        for column, operator, value in (('s.lock_pct', '>=', min_lock), ('s.lock_pct', '<=', max_lock),
+                                        ('s.duration', '>=', min_duration), ('s.duration', '<=', max_duration),
+                                        ('e.id', '=', run_id)):
+            if value is not None:
+                clauses.append('{} {} ?'.format(column, operator))
+                params.append(value)
+        if text:
+            if self.has_notes_index():
+                # every word has to be in the notes, quoted so words like AND aren't read as operators
+                clauses.append('e.entry_id IN (SELECT rowid FROM notes_fts WHERE notes_fts MATCH ?)')
+                params.append(' '.join('"{}"'.format(word.replace('"', '""')) for word in text.split()))
+            else:
+                for word in text.split():
+                    clauses.append('e.notes LIKE ?')
+                    params.append('%' + word + '%')
+        if len(clauses) == 0:
+            return '', params
+        return 'WHERE ' + ' AND '.join(clauses), params
 
-    def get_entries(self, date):
-        try:
-            return list(self.data[date].keys())
-        except KeyError:
+    # runs matching every filter given, each a dict of its entry and summary columns. start and end are
+    # datetime.date and include the whole day, min_lock and max_lock are percents, durations are seconds,
+    # text matches notes containing every word and run_id is the id a run got on its day.
+    # order is one of RUN_ORDERS, limit and offset page through the matches, eg runs this week with over 80% lock:
+    #   data_log.query_runs(start=date.today() - timedelta(days=date.today().weekday()), min_lock=80)
+    def query_runs(self, order='started', descending=False, limit=None, offset=0, **filters):
+        if order not in RUN_ORDERS:
+            raise ValueError('Unknown order: {}'.format(order))
+        where, params = self.run_filter(**filters)
+        sql = ('SELECT e.entry_id, e.date, e.time, e.id, e.notes, e.url1, e.url2, e.started, '
+               's.duration, s.samples, s.lock_pct, s.path_length '
+               'FROM entries e LEFT JOIN summaries s ON s.entry_id = e.entry_id {} ORDER BY {} {}, e.entry_id '
+               'LIMIT ? OFFSET ?').format(where, RUN_ORDERS[order], 'DESC' if descending else 'ASC')
+        rows = self.db.execute(sql, params + [-1 if limit is None else limit, offset])
+        keys = ('entry_id', 'date', 'time', 'id', 'notes', 'url1', 'url2', 'started',
+                'duration', 'samples', 'lock_pct', 'path_length')
+        return [dict(zip(keys, row)) for row in rows]
+
+    # number of runs query_runs would return without a limit, takes the same filters
+    def count_runs(self, **filters):
+        where, params = self.run_filter(**filters)
+        return self.db.execute('SELECT COUNT(*) FROM entries e LEFT JOIN summaries s ON s.entry_id = e.entry_id '
+                               + where, params).fetchone()[0]
+
+    # every run, or the ones between two datetime.date, oldest first
+    def get_runs(self, start=None, end=None):
+        return self.query_runs(start=start, end=end)
+
+    def get_dates(self, limit=None, offset=0):
+        rows = self.db.execute('SELECT date FROM entries GROUP BY date ORDER BY MIN(started) LIMIT ? OFFSET ?',
+                               (-1 if limit is None else limit, offset))
+        return [row[0] for row in rows]
+
+    # times of the entries of a date in order, limit and offset page through them. None if the page is empty
+    def get_entries(self, date, limit=None, offset=0):
+        rows = self.db.execute('SELECT time FROM entries WHERE date = ? ORDER BY time LIMIT ? OFFSET ?',
+                               (date, -1 if limit is None else limit, offset))
+        entries = [row[0] for row in rows]
+        if len(entries) == 0:
             return None
+        return entries
 
     def get_entry(self, date, entry):
-        try:
-            return self.data[date][entry]
-        except KeyError:
+        row = self.db.execute('SELECT entry_id, id, notes, url1, url2 FROM entries WHERE date = ? AND time = ?',
+                              (date, entry)).fetchone()
+        if row is None:
             return None
+        return {'entry_id': row[0], 'id': row[1], 'notes': row[2], 'url1': row[3], 'url2': row[4]}
 
-    def generate_id(self, date):
+    # duration, samples, lock_pct, path_length and the png thumbnail and heatmap of an entry, None if it has none
+    def get_summary(self, date, entry):
+        row = self.db.execute('SELECT s.duration, s.samples, s.lock_pct, s.path_length, s.thumbnail, s.heatmap '
+                              'FROM summaries s JOIN entries e ON e.entry_id = s.entry_id '
+                              'WHERE e.date = ? AND e.time = ?', (date, entry)).fetchone()
+        if row is None:
+            return None
+        return {'duration': row[0], 'samples': row[1], 'lock_pct': row[2], 'path_length': row[3],
+                'thumbnail': row[4], 'heatmap': row[5]}
+
+    # structured array with the TRAJECTORY_DTYPE columns, memory mapped so long runs open instantly.
+    # the trajectories of every camera in a run share their frame and timestamp columns
+    def get_trajectory(self, date, entry, camera=0):
+        full_entry = self.get_entry(date, entry)
+        if full_entry is None:
+            return None
         try:
-            last_entry = list(self.data[date].keys())[-1]     # gets the last key
-            print('key:', last_entry)
-            return self.data[date][last_entry]['id'] + 1  # return last id + 1
-        except KeyError:
+            return np.load(self.trajectory_path(full_entry['entry_id'], camera), mmap_mode='r')
+        except FileNotFoundError:
+            return np.zeros(0, dtype=TRAJECTORY_DTYPE)
+
+    def generate_id(self, date):
+        row = self.db.execute('SELECT id FROM entries WHERE date = ? ORDER BY entry_id DESC LIMIT 1',
+                              (date,)).fetchone()
+        if row is None:
             return 0        # this is the first entry for today
+        return row[0] + 1  # return last id + 1
 
     def edit_notes(self, note, date, entry):
-        self.data[date][entry]['notes'] = note
-        with open(self.json_path, "w") as write_file:
-            json.dump(self.data, write_file)
+        with self.db:
+            self.db.execute('UPDATE entries SET notes = ? WHERE date = ? AND time = ?', (note, date, entry))
 
     def del_entry(self, date, entry):
-        try:
-            popped = self.data[date].pop(entry)
-        except KeyError:
+        popped = self.get_entry(date, entry)
+        if popped is None:
             print('nothing selected')
             return False
 
-        os.remove(r'..\\clips\\' + popped['url1'] + '.avi')
-        os.remove(r'..\\clips\\' + popped['url2'] + '.avi')
-
-        if len(self.data[date]) == 0:
-            self.data.pop(date)
+        with self.db:
+            self.db.execute('DELETE FROM entries WHERE entry_id = ?', (popped['entry_id'],))
+        for camera in self.trajectory_cameras(popped['entry_id']):
+            os.remove(self.trajectory_path(popped['entry_id'], camera))
 
-        with open(self.json_path, "w") as write_file:
-            json.dump(self.data, write_file)
+        # a clip that was never written or was already deleted isn't an error, the entry is gone either way
+        for url in (popped['url1'], popped['url2']):
+            if os.path.exists(self.clip_path(url)):
+                os.remove(self.clip_path(url))
+            if os.path.exists(r'..\\clips\\' + url + '-annotated.avi'):
+                os.remove(r'..\\clips\\' + url + '-annotated.avi')
         return True
@@ -0,0 +1,169 @@
+import argparse
+import csv
+import os
+from datetime import datetime
+from itertools import repeat
+import numpy as np
+from source import data_handler
+
+
+# Writes the logged runs into one table with a row per sample. runs are read and written one at a time,
+# so memory use only depends on the longest run. parquet needs pyarrow, hdf5 needs pytables and excel
+# needs openpyxl, csv has no extra dependencies
+# usage (from the source folder, with the project root on the path like main.py):
+#   python -m source.export ..\data\runs.parquet
+#   python -m source.export ..\data\june.csv --from 2021-06-01 --to 2021-06-30
+
+
+COLUMNS = ['run_id', 'camera', 'date', 'time', 'note', 'frame', 'timestamp', 'x', 'y', 'angle']
+EXCEL_MAX_ROWS = 1048576
+
+
+class CsvExport:
+    def __init__(self, path, runs):
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(COLUMNS)
+
+    def write(self, run, camera, samples):
+        n = len(samples)
+        self.writer.writerows(zip(repeat(run['entry_id'], n), repeat(camera, n),
+                                  repeat(run['date'], n), repeat(run['time'], n), repeat(run['notes'], n),
+                                  samples['frame'].tolist(), samples['timestamp'].tolist(),
+                                  # float32 has about 7 digits, don't print the noise of widening it
+                                  np.round(samples['x'].astype(np.float64), 3).tolist(),
+                                  np.round(samples['y'].astype(np.float64), 3).tolist(),
+                                  np.round(samples['angle'].astype(np.float64), 3).tolist()))
+
+    def close(self):
+        self.file.close()
+
+
+# one row group per run, the run columns are dictionary encoded so they cost next to nothing
+class ParquetExport:
+    def __init__(self, path, runs):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        text = pa.dictionary(pa.int32(), pa.string())
+        self.schema = pa.schema([('run_id', pa.int64()), ('camera', pa.int8()),
+                                 ('date', text), ('time', text), ('note', text),
+                                 ('frame', pa.int64()), ('timestamp', pa.float64()),
+                                 ('x', pa.float32()), ('y', pa.float32()), ('angle', pa.float32())])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, run, camera, samples):
+        pa = self.pa
+        n = len(samples)
+        if n == 0:
+            return
+        indices = pa.array(np.zeros(n, np.int32))
+        arrays = [pa.array(np.full(n, run['entry_id'], np.int64)), pa.array(np.full(n, camera, np.int8))]
+        arrays += [pa.DictionaryArray.from_arrays(indices, pa.array([run[key]], pa.string()))
+                   for key in ['date', 'time', 'notes']]
+        arrays += [pa.array(np.ascontiguousarray(samples[name])) for name in ['frame', 'timestamp', 'x', 'y', 'angle']]
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+# an appendable pandas table, strings have a fixed width there so it's sized from the longest one up front
+class HdfExport:
+    def __init__(self, path, runs):
+        import pandas as pd
+        self.pd = pd
+        self.store = pd.HDFStore(path, mode='w')
+        self.sizes = {'date': 10, 'time': 8,
+                      'note': max([len(run['notes']) for run in runs] + [1])}
+
+    def write(self, run, camera, samples):
+        if len(samples) == 0:
+            return
+        self.store.append('runs', frame_of(self.pd, run, camera, samples), format='table', index=False,
+                          min_itemsize=self.sizes, data_columns=['run_id', 'camera', 'date'])
+
+    def close(self):
+        self.store.close()
+
+
+# slow, the whole workbook is kept in memory until it's saved. a sheet holds about a million rows,
+# runs that don't fit go on the next sheet
+class ExcelExport:
+    def __init__(self, path, runs):
+        import pandas as pd
+        self.pd = pd
+        self.writer = pd.ExcelWriter(path)
+        self.sheet = 1
+        self.row = 0
+
+    def write(self, run, camera, samples):
+        if self.row > 0 and self.row + len(samples) >= EXCEL_MAX_ROWS:
+            self.sheet += 1
+            self.row = 0
+        frame_of(self.pd, run, camera, samples).to_excel(self.writer, sheet_name='runs {}'.format(self.sheet),
+                                                 startrow=self.row, header=self.row == 0, index=False)
+        self.row += len(samples) + (1 if self.row == 0 else 0)
+
+    def close(self):
+        self.writer.close()
+
+
+def frame_of(pd, run, camera, samples):
+    n = len(samples)
+    return pd.DataFrame({'run_id': np.full(n, run['entry_id'], np.int64),
+                         'camera': np.full(n, camera, np.int8),
+                         'date': np.full(n, run['date'], object),
+                         'time': np.full(n, run['time'], object),
+                         'note': np.full(n, run['notes'], object),
+                         'frame': samples['frame'], 'timestamp': samples['timestamp'],
+                         'x': samples['x'], 'y': samples['y'], 'angle': samples['angle']})
+
+
+FORMATS = {'.csv': CsvExport, '.parquet': ParquetExport, '.h5': HdfExport, '.hdf5': HdfExport,
+           '.xlsx': ExcelExport}
+
+
+# writes runs (default every run, or the ones between the start and end dates) to path,
+# the format comes from the extension. returns the number of samples written
+def export_runs(data_log, path, runs=None, start=None, end=None):
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError('Unknown export format {}, use one of {}'.format(extension, ', '.join(FORMATS)))
+    if runs is None:
+        runs = data_log.get_runs(start, end)
+
+    rows = 0
+    writer = FORMATS[extension](path, runs)
+    files = data_log.trajectory_files()
+    try:
+        for run in runs:
+            for camera in files.get(run['entry_id'], []):
+                samples = np.load(data_log.trajectory_path(run['entry_id'], camera), mmap_mode='r')
+                writer.write(run, camera, samples)
+                rows += len(samples)
+    finally:
+        writer.close()
+    print('exported {} runs, {} samples to {}'.format(len(runs), rows, path))
+    return rows
+
+
+def parse_date(text):
+    return datetime.strptime(text, '%Y-%m-%d').date()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Export logged runs to one csv, parquet, hdf5 or xlsx file')
+    parser.add_argument('path', help='output file, the extension picks the format: ' + ', '.join(FORMATS))
+    parser.add_argument('--from', dest='start', type=parse_date, default=None, help='first date, YYYY-MM-DD')
+    parser.add_argument('--to', dest='end', type=parse_date, default=None, help='last date, YYYY-MM-DD')
+    parser.add_argument('--db', default=os.path.join('..', 'data', 'data_logs.db'))
+    parser.add_argument('--runs', default=os.path.join('..', 'data', 'runs'))
+    args = parser.parse_args(args)
+
+    data_log = data_handler.DataLog(db_path=args.db, runs_path=args.runs, read_only=True)
+    export_runs(data_log, args.path, start=args.start, end=args.end)
+
+
+if __name__ == '__main__':
+    main()
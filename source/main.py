@@ -1,3 +1,5 @@
+import time
+STARTED = time.perf_counter()  # before the slow imports below, the time to the first frame is counted from here
 import tkinter as tk
 from source import camera
 from source import data_handler
@@ -17,6 +19,9 @@ class MainController(tk.Frame):
         self.configure(background=bg_color)
 
         self.data_log = data_handler.DataLog()
+        self.panelModel = SidePanelModel()
+        self.panelModel.active_tab = 'Motion'
+        self.startup_times = {}  # seconds from STARTED until the window and each video's first frame were shown
 
         # initializing the default states
         # sources 0 and 1 are webcam ports. 3 maybe. the last one is url for example video
@@ -27,11 +32,15 @@ class MainController(tk.Frame):
                                         l_tracker='motion',
                                         r_tracker='none')
         self.left_video = camera.VideoCapture(source=self.vidModel.cur_left_source,
-                                              side='left')
+                                              side='left',
+                                              open_async=self.panelModel.fast_start)
         self.right_video = camera.VideoCapture(source=self.vidModel.cur_right_source,
-                                               side='right')
+                                               side='right',
+                                               open_async=self.panelModel.fast_start)
         self.left_video.use_tracker = self.vidModel.left_tracker
         self.right_video.use_tracker = self.vidModel.right_tracker
+        # every camera is ticked together so their frames and logged positions line up in time
+        self.cameras = camera.CameraGroup([self.left_video, self.right_video])
 
         # initializations for the UI elements and its associated models
         self.vidModel.init_video_dimensions(self.left_video.height, self.right_video.height)
@@ -62,8 +71,6 @@ class MainController(tk.Frame):
         self.vidView.rightVideo.sel_source.trace('w', self.on_right_source_select)
         self.vidView.rightVideo.flip_button.bind('<Button-1>', self.on_right_flip_select)
 
-        self.panelModel = SidePanelModel()
-        self.panelModel.active_tab = 'Motion'
         self.panelView = SidePanelView(self, self.panelModel.config)
         self.panelView.grid(row=0, column=1, rowspan=2, sticky='nsew')
         self.panelView.configure(background=bg_color)
@@ -82,6 +89,18 @@ class MainController(tk.Frame):
         self.right_video.trackers['hsv'].color_high = self.panelView.high_colors
         self.left_video.trackers['motion'].min_area = self.panelView.motion_slider_pos
         self.right_video.trackers['motion'].min_area = self.panelView.motion_slider_pos
+        self.left_video.set_roi(self.panelModel.get_roi('left'))
+        self.right_video.set_roi(self.panelModel.get_roi('right'))
+        self.left_video.set_local_search(self.panelModel.local_search, self.panelModel.search_margin)
+        self.right_video.set_local_search(self.panelModel.local_search, self.panelModel.search_margin)
+        for video in (self.left_video, self.right_video):
+            video.set_scale('hsv', self.panelModel.get_scale('HSV'))
+            video.set_scale('motion', self.panelModel.get_scale('Motion'))
+            video.set_buffer_reuse(self.panelModel.reuse_buffers)
+            video.enable_profiling(self.panelModel.profiling)
+            video.set_show_stats(self.panelModel.stats_overlay)
+        self.vidModel.buffers.enabled = self.panelModel.reuse_buffers
+        self.master.bind('<F3>', self.toggle_stats_event)
 
         self.navModel = NavigationModel(self.data_log)
         self.navView = NavigationView(self)
@@ -91,11 +110,13 @@ class MainController(tk.Frame):
         self.navView.date_tab.update_list(self.navModel.date_list)
         self.navView.date_tab.file_list.bind('<<ListboxSelect>>', self.on_date_select)
         self.navView.entry_tab.file_list.bind('<<ListboxSelect>>', self.on_entry_select)
+        self.navView.entry_tab.on_end = self.load_more_entries
 
         self.navView.edit_button.bind('<Button-1>', self.edit_note_event)
         self.navView.video_button1.bind('<Button-1>', self.view_clip_event)
         self.navView.video_button2.bind('<Button-1>', self.view_clip_event)
         self.navView.excel_button.bind('<Button-1>', self.export_excel_event)
+        self.navView.export_all_button.bind('<ButtonRelease-1>', self.export_all_event)
         self.navView.del_button.bind('<Button-1>', self.del_entry_event)
 
         # pop-up windows
@@ -109,9 +130,21 @@ class MainController(tk.Frame):
 
         self.master.protocol("WM_DELETE_WINDOW", self.exit)
 
-        self.refresh(self.left_video)
-        self.refresh(self.right_video)
+        self.refresh()
         self.animate_graphs()
+        self.master.after_idle(self.window_shown)
+
+    def window_shown(self):
+        self.startup_times['window'] = time.perf_counter() - STARTED
+        print('window shown after {:.2f}s'.format(self.startup_times['window']))
+
+    # only the first frame each video shows is timed
+    def first_frame_shown(self, video):
+        if video.side in self.startup_times:
+            return
+        self.startup_times[video.side] = time.perf_counter() - STARTED
+        print('{} first frame after {:.2f}s, source opened after {:.2f}s'.format(
+            video.side, self.startup_times[video.side], video.opened_at - STARTED))
 
     # ---File Navigator Functions---
 
@@ -121,8 +154,13 @@ class MainController(tk.Frame):
             return
         self.navModel.sel_date_idx = date_list.curselection()[0]
         self.navModel.sel_date = date_list.get(self.navModel.sel_date_idx)
-        entries = self.data_log.get_entries(self.navModel.sel_date)
-        self.navView.entry_tab.update_list(entries)
+        self.navView.entry_tab.update_list(self.navModel.first_entries())
+
+    # the entry list only holds a page of a date at a time, the next one is added when it's scrolled to the end
+    def load_more_entries(self):
+        entries = self.navModel.more_entries()
+        self.navView.entry_tab.append_list(entries)
+        return entries is not None
 
     def on_entry_select(self, event):
         entry_list = self.navView.entry_tab.file_list
@@ -131,6 +169,7 @@ class MainController(tk.Frame):
         self.navModel.sel_entry_idx = entry_list.curselection()[0]
         self.navModel.sel_entry = entry_list.get(self.navModel.sel_entry_idx)
         print(self.navModel.sel_entry)
+        self.navView.show_summary(self.data_log.get_summary(self.navModel.sel_date, self.navModel.sel_entry))
         note = self.data_log.get_entry(self.navModel.sel_date, self.navModel.sel_entry)['notes']
         if note is not None:
             self.navView.details_tab.configure(state='normal')
@@ -164,11 +203,18 @@ class MainController(tk.Frame):
             url = 'url2'
         print(url)
         name = self.data_log.get_entry(self.navModel.sel_date, self.navModel.sel_entry)[url]
-        self.clip_viewer = ViewClipWindow(self, name)
+        trajectory = self.data_log.get_trajectory(self.navModel.sel_date, self.navModel.sel_entry,
+                                                  camera=0 if url == 'url1' else 1)
+        self.clip_viewer = ViewClipWindow(self, name, trajectory)
 
     def export_excel_event(self, event):
         self.navModel.export_excel()
 
+    def export_all_event(self, event):
+        path = self.navView.ask_export_path()
+        if path:
+            self.navModel.export_all(path)
+
     def del_entry_event(self, event):
         deleted = self.data_log.del_entry(self.navModel.sel_date, self.navModel.sel_entry)
         if deleted:  # deletion was successful
@@ -179,7 +225,7 @@ class MainController(tk.Frame):
                 self.navView.reload_dates([])  # put empty list into both tabs
                 self.navView.reload_entries([])
             # if the last entry for date is deleted
-            elif self.data_log.get_entries(self.navModel.sel_date) is None:
+            elif self.data_log.get_entries(self.navModel.sel_date, limit=1) is None:
                 self.navView.reload_dates(dates)
                 self.navView.reload_entries([])
                 if self.navModel.sel_date_idx >= self.navView.date_tab.size():
@@ -188,7 +234,7 @@ class MainController(tk.Frame):
                     self.navView.date_tab.set_selection(self.navModel.sel_date_idx)
             # if entries still exist
             else:
-                self.navView.reload_entries(self.data_log.get_entries(self.navModel.sel_date))
+                self.navView.reload_entries(self.navModel.reload_entries())
                 print('size: ', self.navView.entry_tab.size())
                 print('idx: ', self.navModel.sel_entry_idx)
                 if self.navModel.sel_entry_idx >= self.navView.entry_tab.size():
@@ -212,11 +258,14 @@ class MainController(tk.Frame):
                                  url2=self.right_video.generate_vid_name(self.data_log))
         self.navView.reload_dates(self.data_log.get_dates())
         self.navView.date_tab.set_selection('end')
+        while self.load_more_entries():  # the new entry is on the last page
+            pass
         self.navView.entry_tab.set_selection('end')
         self.details_editor.destroy()
         print('saved')
 
     def discard_entry_event(self, event):
+        self.data_log.discard_entry()
         self.details_editor.destroy()
         print('discarded')
 
@@ -263,22 +312,44 @@ class MainController(tk.Frame):
 
     def animate_graphs(self):
         # call animate graph function using animate period and check if there is a lock on an object
-        for name in self.panelView.graph_names:
-            if self.left_video.has_track():
-                self.panelView.graphs['Angle'].update_values(self.left_video.cur_tracker.angle)
-                self.panelView.graphs['Position'].update_values(self.left_video.cur_tracker.position[0])
-                if self.panelView.graph_nb.tab(self.panelView.graph_nb.select(), 'text') == name:
-                    self.panelView.graphs[name].animate()
-        self.record_data()
+        if self.left_video.has_track():
+            self.panelView.graphs['Angle'].update_values(self.left_video.cur_tracker.angle)
+            self.panelView.graphs['Position'].update_values(self.left_video.cur_tracker.position[0])
+            # only the graph on the selected tab is visible, the others catch up when they're shown
+            name = self.panelView.graph_nb.tab(self.panelView.graph_nb.select(), 'text')
+            self.panelView.graphs[name].animate()
         self.master.after(self.left_video.refresh_period * 4, self.animate_graphs)
 
+    def toggle_stats_event(self, event):
+        for video in self.cameras.videos:
+            video.set_show_stats(not video.show_stats)
+
+    def print_profiles(self):
+        for name, seconds in self.startup_times.items():
+            print('startup: {} after {:.2f}s'.format(name, seconds))
+        for video in self.cameras.videos:
+            if not video.timer.enabled:
+                continue
+            profile = video.profile()
+            print(video.side, '{:.1f} / {:.1f} fps, {} read, {} dropped'.format(
+                profile['fps'], profile['source_fps'], profile['frames_read'], profile['frames_dropped']))
+            for name, stats in list(profile['stages'].items()) + list(profile['tracker'].items()):
+                print('  {:<10} mean {:6.2f} ms  p90 {:6.2f} ms  p99 {:6.2f} ms'.format(
+                    name, stats['mean_ms'], stats['p90_ms'], stats['p99_ms']))
+
     def exit(self, event=None):
+        self.print_profiles()
         self.panelModel.save_settings(self.panelView.slider_names,
                                       self.panelView.hsv_sliders,
                                       self.panelView.motion_slider)
         if self.vidModel.is_recording:
             self.left_video.stop_record()
+            self.right_video.stop_record()
+            self.data_log.flush()  # the unsaved run is recovered on the next start
             self.vidModel.is_recording = False
+        self.left_video.stop_reader()
+        self.right_video.stop_reader()
+        self.cameras.close()
         self.quit()
 
     # ---Video Viewer Frame Functions---
@@ -304,15 +375,14 @@ class MainController(tk.Frame):
             self.vidModel.cur_left_source = source
         else:
             return
-        prev_framerate = self.left_video.framerate
         self.left_video.change_source(self.vidModel.cur_left_source)
+        self.cameras.clear(self.left_video)
         # update the available sources on the other side to prevent both having the same one
         self.vidView.rightVideo.reload_source_options(self.vidModel.get_sources('right'), 'r')
         print('left click')
         print(self.left_video.framerate)
-        # prevent double framerate when changing between sources that have active framerates
-        if prev_framerate == 0 or self.left_video.framerate == 0:
-            self.refresh(self.left_video)
+        if self.left_video.framerate == 0:
+            print(self.left_video.side, 'video source has issues')
 
     def on_right_source_select(self, *args):
         try:
@@ -324,13 +394,13 @@ class MainController(tk.Frame):
             self.vidModel.cur_right_source = source
         else:
             return
-        prev_framerate = self.right_video.framerate
         self.right_video.change_source(self.vidModel.cur_right_source)
+        self.cameras.clear(self.right_video)
         # update the available sources on the other side to prevent both having the same one
         self.vidView.leftVideo.reload_source_options(self.vidModel.get_sources('left'), 'l')
         print('right click')
-        if prev_framerate == 0 or self.right_video.framerate == 0:
-            self.refresh(self.right_video)
+        if self.right_video.framerate == 0:
+            print(self.right_video.side, 'video source has issues')
 
     def on_left_flip_select(self, event):
         self.left_video.flip = not self.vidView.leftVideo.flip_state.get()
@@ -340,11 +410,7 @@ class MainController(tk.Frame):
     def on_right_flip_select(self, event):
         self.right_video.flip = not self.vidView.rightVideo.flip_state.get()
 
-    def refresh(self, video):
-        if self.vidModel.is_recording:
-            self.left_video.capture_frame()
-            self.right_video.capture_frame()
-
+    def refresh(self):
         if self.panelModel.active_slider_name is not None:
             slider_id = self.panelModel.active_slider_name
             slider_val = self.panelModel.active_slider.get()
@@ -356,39 +422,54 @@ class MainController(tk.Frame):
                 self.left_video.trackers['motion'].set_filter_thresh(slider_val)
                 self.right_video.trackers['motion'].set_filter_thresh(slider_val)
 
-        if video.update() is not None:
-            frame = self.vidModel.resize_frame(video.get_frame())
-            if video.side == 'left':
-                self.vidView.leftVideo.refresh(frame)
-                self.panelView.graphs['Angle'].increment_frames()
-            elif video.side == 'right':
-                self.vidView.rightVideo.refresh(frame)
-
-        if video.framerate != 0:
-            self.master.after(video.refresh_period, self.refresh, video)
-            # print(video.side, 'fps:', video.framerate)
-        else:
-            print(video.side, 'video source has issues')
-
+        if self.cameras.update() is not None:
+            for video in self.cameras.updated:
+                frame = video.get_frame()
+                t = time.perf_counter()
+                frame = self.vidModel.resize_frame(frame, video.side)
+                t = video.timer.lap('resize', t)
+                if video.side == 'left':
+                    self.vidView.leftVideo.refresh(frame)
+                    for graph in self.panelView.graphs.values():
+                        graph.increment_frames()
+                elif video.side == 'right':
+                    self.vidView.rightVideo.refresh(frame)
+                video.timer.lap('display', t)
+                self.first_frame_shown(video)
+            self.record_data()  # every tick is logged, not just the ones the graphs see
+
+        self.master.after(self.cameras.refresh_period, self.refresh)
+
+    # one sample per camera that got a frame on the last tick, cameras without a lock log the no lock values.
+    # each sample keeps the frame of the camera's clip it was drawn on, the frame column pairs the cameras
     def record_data(self):
         if self.vidModel.is_recording:
-            if self.left_video.has_track():
-                self.data_log.append_values(self.left_video.cur_tracker.position,
-                                            self.left_video.cur_tracker.angle)
-            else:
-                self.data_log.append_values((-1, -1), -1)
+            tracks = []
+            for video in self.cameras.videos:
+                if video not in self.cameras.updated:
+                    tracks.append(None)
+                elif video.has_track():
+                    tracks.append((video.cur_tracker.position, video.cur_tracker.angle, video.clip_frame))
+                else:
+                    tracks.append(((-1, -1), -1, video.clip_frame))
+            self.data_log.append_tick(self.cameras.tick, self.cameras.timestamp, tracks)
 
     def record_event(self, event):
         if self.vidModel.is_recording:
             self.left_video.stop_record()
             self.right_video.stop_record()
+            self.data_log.flush()  # if the app is closed before the note is saved the run is recovered whole
             self.vidView.record_text.set("Record")
             self.create_editor_window()
             print('stopped recording')
         else:
             self.vidView.record_text.set("Recording (Click again to stop)")
-            self.left_video.start_record(self.left_video.generate_vid_name(self.data_log))
-            self.right_video.start_record(self.right_video.generate_vid_name(self.data_log))
+            for video in (self.left_video, self.right_video):
+                video.start_record(video.generate_vid_name(self.data_log),
+                                   raw=self.panelModel.raw_recording, raw_codec=self.panelModel.raw_codec)
+            self.data_log.start_recording(self.left_video.generate_vid_name(self.data_log),
+                                          self.right_video.generate_vid_name(self.data_log),
+                                          cameras=len(self.cameras.videos))
             print('is recording')
         # toggle recording state with button
         self.vidModel.is_recording = not self.vidModel.is_recording
@@ -1,8 +1,9 @@
 import tkinter as tk
 from tkinter import ttk
-import pandas as pd
 from configparser import ConfigParser
 import cv2
+from source import camera
+from source import export
 # from PIL import ImageTk, Image
 # import matplotlib.pyplot as plt
 # from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
@@ -36,12 +37,58 @@ class SidePanelModel:
         with open(self.config_path, 'w') as f:
             self.config.write(f)
 
+    # region of interest the trackers of a camera side are limited to, None for the full frame
+    def get_roi(self, side):
+        return camera.parse_roi(self.config.get('ROI', side, fallback=''))
+
+    # processing scale of a tracker, the section is the tracker's tab name
+    def get_scale(self, section):
+        return self.config.getfloat(section, 'scale', fallback=1)
+
+    @property
+    def local_search(self):
+        return self.config.getboolean('Search', 'local', fallback=False)
+
+    @property
+    def search_margin(self):
+        return self.config.getint('Search', 'margin', fallback=40)
+
+    # record the frames without the tracking drawn on them, source.render draws it afterwards
+    @property
+    def raw_recording(self):
+        return self.config.getboolean('Recording', 'raw', fallback=False)
+
+    @property
+    def raw_codec(self):
+        return self.config.get('Recording', 'raw codec', fallback='MJPG')
+
+    # reuse the frame buffers of the trackers and videos instead of allocating new ones every frame
+    @property
+    def reuse_buffers(self):
+        return self.config.getboolean('Buffers', 'reuse', fallback=True)
+
+    # collect the stage timings of the cameras, printed when the app exits
+    @property
+    def profiling(self):
+        return self.config.getboolean('Profiling', 'enabled', fallback=False)
+
+    # open the cameras in the background so the window shows right away, a missing device can block for seconds
+    @property
+    def fast_start(self):
+        return self.config.getboolean('Startup', 'fast', fallback=True)
+
+    # show the fps and stage times on top of the videos, F3 toggles it while running
+    @property
+    def stats_overlay(self):
+        return self.config.getboolean('Profiling', 'overlay', fallback=False)
+
 
 class NavigationModel:
     def __init__(self, data_log):
         self.data_log = data_log
         self.date_list = data_log.get_dates()
-        print(self.date_list)
+        self.page_size = 100  # entries of a date loaded at a time, more are loaded when the list is scrolled down
+        self.entries_loaded = 0
 
         self.is_editing = False
 
@@ -50,25 +97,46 @@ class NavigationModel:
         self.sel_entry = ''
         self.sel_entry_idx = None
 
+    # first page of entries of the selected date, None if it has none
+    def first_entries(self):
+        entries = self.data_log.get_entries(self.sel_date, limit=self.page_size)
+        self.entries_loaded = 0 if entries is None else len(entries)
+        return entries
+
+    # the page after the entries already loaded, None once they all are
+    def more_entries(self):
+        if self.entries_loaded < self.page_size:
+            return None  # the last page wasn't full
+        entries = self.data_log.get_entries(self.sel_date, limit=self.page_size, offset=self.entries_loaded)
+        if entries is not None:
+            self.entries_loaded += len(entries)
+        return entries
+
+    # the entries loaded so far again, after one was deleted
+    def reload_entries(self):
+        entries = self.data_log.get_entries(self.sel_date, limit=max(self.entries_loaded, self.page_size))
+        self.entries_loaded = 0 if entries is None else len(entries)
+        return entries
+
+    # the selected run only
     def export_excel(self):
-        excel_entry = []
-        full_entry = self.data_log.get_entry(self.sel_date, self.sel_entry)
-        excel_entry.append(eval(full_entry['x']))
-        excel_entry.append(eval(full_entry['y']))
-        excel_entry.append(eval(full_entry['angle']))
-
-        print(excel_entry)
-        df = pd.DataFrame(excel_entry).transpose()
-        df.columns = ['x', 'y', 'angle']
-        print(df)
+        run = self.data_log.get_entry(self.sel_date, self.sel_entry)
+        if run is None:
+            print('nothing selected')
+            return
+        run.update({'date': self.sel_date, 'time': self.sel_entry})
+        export.export_runs(self.data_log, r'..\\data\\exported_data.xlsx', runs=[run])
 
-        df.to_excel(r'..\\data\\exported_data.xlsx', index=False, header=True)
+    # every run into one file, the extension of path picks the format
+    def export_all(self, path):
+        export.export_runs(self.data_log, path)
 
 
 class VideoFrameModel:
     def __init__(self, sources, l_source, r_source, l_tracker, r_tracker):
         self.is_recording = False
         self.height_cap = 720
+        self.buffers = camera.BufferPool()
         self.all_sources = sources
         self.cur_left_source = sources[l_source]
         self.cur_right_source = sources[r_source]
@@ -91,15 +159,19 @@ class VideoFrameModel:
             self.right_sources.remove(self.cur_left_source)
             return self.right_sources
 
+    # sources that aren't open yet have a height of 0, resize_frame lowers the cap when their first frame comes in
     def init_video_dimensions(self, height1, height2):
         print(height1, height2)
-        smallest_height = min((height1, height2))
-        if self.height_cap > smallest_height:
-            self.height_cap = smallest_height
-
-    def resize_frame(self, frame):
+        heights = [height for height in (height1, height2) if height > 0]
+        if len(heights) > 0 and self.height_cap > min(heights):
+            self.height_cap = min(heights)
+
+    # name keeps a reused output frame per video, the output is overwritten by the next frame with that name
+    def resize_frame(self, frame, name='frame'):
+        if self.height_cap > frame.shape[0]:
+            self.height_cap = frame.shape[0]
         scale_percent = self.height_cap / frame.shape[0]
         width = int(frame.shape[1] * scale_percent)
         height = int(frame.shape[0] * scale_percent)
-        output = cv2.resize(frame, (width, height))
+        output = cv2.resize(frame, (width, height), dst=self.buffers.get(name, (height, width) + frame.shape[2:]))
         return output
@@ -0,0 +1,74 @@
+import time
+from collections import deque
+import numpy as np
+
+
+# Timings of the stages of the tracking loop, off unless something turns it on
+
+
+# mean and percentiles in milliseconds of a list of durations in seconds
+def percentiles(times):
+    times = np.array(times) * 1000
+    return {'mean_ms': float(np.mean(times)),
+            'p50_ms': float(np.percentile(times, 50)),
+            'p90_ms': float(np.percentile(times, 90)),
+            'p99_ms': float(np.percentile(times, 99)),
+            'max_ms': float(np.max(times))}
+
+
+class StageTimer:
+    def __init__(self, window=300):
+        self.enabled = False
+        self.window = window  # timings kept per stage, None keeps every one
+        self.times = {}  # stage name -> seconds of the most recent runs
+        self.ticks = {}  # event name -> perf_counter times it last happened at
+
+    # records the time since start under name and returns now, so stages can be chained:
+    #   t = time.perf_counter()
+    #   ...
+    #   t = timer.lap('blur', t)
+    def lap(self, name, start):
+        now = time.perf_counter()
+        self.record(name, now - start)
+        return now
+
+    def record(self, name, seconds):
+        if self.enabled:
+            if name not in self.times:
+                self.times[name] = deque(maxlen=self.window)
+            self.times[name].append(seconds)
+
+    # records that an event happened now, rate() turns these into events per second
+    def tick(self, name):
+        if self.enabled:
+            if name not in self.ticks:
+                self.ticks[name] = deque(maxlen=self.window)
+            self.ticks[name].append(time.perf_counter())
+
+    # events per second over the kept ticks, 0 until there are two
+    def rate(self, name):
+        ticks = self.ticks.get(name)
+        if ticks is None or len(ticks) < 2 or ticks[-1] == ticks[0]:
+            return 0
+        return (len(ticks) - 1) / (ticks[-1] - ticks[0])
+
+    # mean of the kept timings of a stage in milliseconds, 0 if it never ran
+    def mean_ms(self, name):
+        times = self.times.get(name)
+        if times is None or len(times) == 0:
+            return 0
+        return sum(times) / len(times) * 1000
+
+    # stage name -> count, mean and percentiles of the kept timings in milliseconds
+    def stats(self):
+        stats = {}
+        for name, times in self.times.items():
+            if len(times) == 0:
+                continue
+            stats[name] = percentiles(times)
+            stats[name]['count'] = len(times)
+        return stats
+
+    def reset(self):
+        self.times = {}
+        self.ticks = {}
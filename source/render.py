@@ -0,0 +1,136 @@
+import argparse
+import os
+import sqlite3
+import time
+import cv2
+import numpy as np
+from source import batch
+from source import camera
+from source import data_handler
+
+
+# Draws the tracking onto recorded clips after the experiment, from the logged trajectories.
+# record with raw = True under [Recording] in config.ini so the live session only stores the frames
+# usage (from the source folder, with the project root on the path like main.py):
+#   python -m source.render                      every entry that doesn't have annotated clips yet
+#   python -m source.render --date 06/14/2021 --workers 4
+#   python -m source.render --clip ..\clips\06-14-2021-0a.avi --trajectory ..\data\runs\12.npy
+
+
+DB_PATH = os.path.join('..', 'data', 'data_logs.db')
+RUNS_DIR = os.path.join('..', 'data', 'runs')
+CLIPS_DIR = os.path.join('..', 'clips')
+ANNOTATED_SUFFIX = '-annotated'
+
+
+def annotated_path(clip):
+    name, ext = os.path.splitext(clip)
+    return name + ANNOTATED_SUFFIX + ext
+
+
+# the camera 0 and camera 1 clips of every entry, with their trajectories, that haven't been rendered yet
+def find_jobs(db_path, runs_path, clips_path, date=None, overwrite=False):
+    db = sqlite3.connect('file:{}?mode=ro'.format(db_path), uri=True)  # never touches a running session's log
+    query = 'SELECT entry_id, url1, url2 FROM entries'
+    params = ()
+    if date is not None:
+        query += ' WHERE date = ?'
+        params = (date,)
+    jobs = []
+    for row, url1, url2 in db.execute(query + ' ORDER BY entry_id', params):
+        for cam, url in enumerate([url1, url2]):
+            clip = os.path.join(clips_path, url + '.avi')
+            trajectory = data_handler.trajectory_file(runs_path, row, cam)
+            if not os.path.exists(clip) or not os.path.exists(trajectory):
+                continue
+            if overwrite or not os.path.exists(annotated_path(clip)):
+                jobs.append((clip, trajectory, annotated_path(clip)))
+    db.close()
+    return jobs
+
+
+# the box and velocity arrow the live tracker would have drawn for one sample, colors are bgr.
+# pose is a camera.Tracker that is only used for drawing
+def draw_sample(output, pose, samples, i, box_color=(0, 255, 0), arrow_color=(0, 0, 255)):
+    x, y, angle = samples['x'][i], samples['y'][i], samples['angle'][i]
+    if angle < 0:  # no lock on this frame
+        return
+    pose.set_pose((x, y), angle)
+    cv2.polylines(output, [pose.get_rectangle()], 1, box_color, 2)
+    if i > 0 and samples['angle'][i - 1] >= 0:
+        pose.step = (x - samples['x'][i - 1], y - samples['y'][i - 1])
+        cv2.arrowedLine(output, *pose.velocity_arrow(), arrow_color, 2)
+
+
+# writes a copy of the clip with its trajectory drawn on, each sample on the clip frame it was logged for
+def render_clip(clip, trajectory_path, out_path):
+    samples = np.load(trajectory_path, mmap_mode='r')
+    lookup = data_handler.frame_samples(samples, int(samples['clip_frame'].max()) + 1 if len(samples) > 0 else 0)
+    vid = cv2.VideoCapture(clip)
+    if not vid.isOpened():
+        print('Could not open video', clip)
+        return 0
+    framerate = vid.get(cv2.CAP_PROP_FPS) or 24
+    size = (int(vid.get(cv2.CAP_PROP_FRAME_WIDTH)), int(vid.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    recorder = camera.VideoRecorder(out_path, framerate, size)
+    pose = camera.Tracker()
+    frame = None
+    i = 0
+    while True:
+        ret, frame = vid.read(frame)
+        if not ret:
+            break
+        # clips are stored as rgb, draw in bgr like the live overlay and let the recorder swap it back
+        frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR, dst=frame)
+        if i < len(lookup) and lookup[i] >= 0:
+            draw_sample(frame, pose, samples, lookup[i])
+        recorder.write(frame, block=True)  # offline, so wait for the encoder instead of dropping
+        i += 1
+    vid.release()
+    recorder.close()
+    if len(lookup) == 0:
+        print('{}: no samples are tied to frames of the clip, nothing was drawn'.format(clip))
+    elif i != len(lookup):
+        print('{}: {} frames but samples for {}, the overlay may be off'.format(clip, i, len(lookup)))
+    return i
+
+
+def render_worker(job):
+    start = time.perf_counter()
+    frames = render_clip(*job)
+    return job[2], frames, time.perf_counter() - start
+
+
+def render_clips(jobs, workers=1):
+    for out_path, frames, elapsed in batch.run_jobs(render_worker, jobs, workers):
+        print('{}: {} frames in {:.2f}s ({:.1f} fps)'.format(out_path, frames, elapsed,
+                                                           frames / max(elapsed, 1e-9)))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Draw the logged tracking onto recorded clips')
+    parser.add_argument('--date', default=None, help='only render the entries of this date, like 06/14/2021')
+    parser.add_argument('--clip', default=None, help='render a single clip, needs --trajectory')
+    parser.add_argument('--trajectory', default=None, help='.npy trajectory of the single clip')
+    parser.add_argument('--out', default=None, help='output of the single clip, defaults to <clip>-annotated')
+    parser.add_argument('--overwrite', action='store_true', help='render clips that already have an annotated copy')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes, 0 uses every core')
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--runs', default=RUNS_DIR)
+    parser.add_argument('--clips', default=CLIPS_DIR)
+    args = parser.parse_args(args)
+
+    if args.clip is not None:
+        if args.trajectory is None:
+            parser.error('--clip needs --trajectory')
+        jobs = [(args.clip, args.trajectory, args.out or annotated_path(args.clip))]
+    else:
+        jobs = find_jobs(args.db, args.runs, args.clips, args.date, args.overwrite)
+    if len(jobs) == 0:
+        print('nothing to render')
+        return
+    render_clips(jobs, args.workers)
+
+
+if __name__ == '__main__':
+    main()
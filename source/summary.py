@@ -0,0 +1,62 @@
+import cv2
+import numpy as np
+from source import analytics
+
+
+# Small overview of a run worked out once when it's saved, so listing runs never touches the trajectory or the clip
+
+
+THUMBNAIL_WIDTH = 160
+HEATMAP_BINS = 32  # across the width of the frame
+
+
+# middle frame of a clip as a png thumbnail, the size of the full frame and the framerate.
+# cameras often start dark while they adjust, so the first frame is a poor picture of the run
+def read_thumbnail(clip_path, width=THUMBNAIL_WIDTH):
+    vid = cv2.VideoCapture(clip_path)
+    vid.set(cv2.CAP_PROP_POS_FRAMES, int(vid.get(cv2.CAP_PROP_FRAME_COUNT)) // 2)
+    ret, frame = vid.read()
+    framerate = vid.get(cv2.CAP_PROP_FPS)
+    vid.release()
+    if not ret:
+        return None, None, framerate
+    # clips are stored as rgb
+    frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+    height = int(frame.shape[0] * width / frame.shape[1])
+    thumbnail = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+    return cv2.imencode('.png', thumbnail)[1].tobytes(), frame.shape[:2], framerate
+
+
+# frames per second of a clip, 30 when opencv can't read it. it gives 0 or -1 then
+def clip_framerate(clip_path):
+    vid = cv2.VideoCapture(clip_path)
+    framerate = vid.get(cv2.CAP_PROP_FPS)
+    vid.release()
+    return framerate if framerate > 0 else 30
+
+
+def heatmap_image(counts, width=THUMBNAIL_WIDTH):
+    if counts.max() > 0:
+        counts = np.log1p(counts) / np.log1p(counts.max())  # log so a few long stops don't wash out the rest
+    image = cv2.applyColorMap(np.uint8(counts * 255), cv2.COLORMAP_JET)
+    height = int(counts.shape[0] * width / counts.shape[1])
+    image = cv2.resize(image, (width, height), interpolation=cv2.INTER_NEAREST)
+    return cv2.imencode('.png', image)[1].tobytes()
+
+
+# samples is a trajectory array, clip_path the video it was tracked from
+def summarize(samples, clip_path):
+    thumbnail, shape, framerate = read_thumbnail(clip_path)
+    # old entries were logged without timestamps. opencv gives 0 or -1 for a clip it can't read
+    info = analytics.describe(samples, framerate if framerate and framerate > 0 else 30)
+
+    if shape is None:  # no clip to size the heatmap from, use the area the ant covered
+        x, y = analytics.positions(samples)
+        shape = (int(np.nanmax(y, initial=0)) + 1, int(np.nanmax(x, initial=0)) + 1)
+
+    return {'duration': info['duration'],
+            'samples': info['samples'],
+            'lock_pct': info['lock_pct'],
+            'path_length': info['path_length'],
+            'thumbnail': thumbnail,
+            'heatmap': heatmap_image(analytics.occupancy(samples, shape, HEATMAP_BINS))}
@@ -1,10 +1,13 @@
+import base64
 import tkinter as tk
+import numpy as np
 from tkinter import ttk
+from tkinter import filedialog
 from configparser import ConfigParser
 from source import camera
+from source import data_handler
+from source import render
 from PIL import ImageTk, Image
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 
 
 # In charge of the UI elements/Frontend
@@ -95,21 +98,70 @@ class SidePanelView(tk.Frame):
         return tuple(self.hsv_sliders[i].get() for i in range(0, self.num_hsv_sliders) if i % 2 == 1)
 
 
+# fixed size window of the latest (x, y) points. every point is written twice, capacity apart,
+# so the window is always one contiguous slice and reading it never copies
+class RingBuffer:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.data = np.zeros((2, 2 * capacity))
+        self.start = 0
+        self.size = 0
+
+    def append(self, x, y):
+        end = (self.start + self.size) % self.capacity
+        self.data[:, end] = self.data[:, end + self.capacity] = (x, y)
+        if self.size < self.capacity:
+            self.size += 1
+        else:
+            self.start = (self.start + 1) % self.capacity
+
+    @property
+    def x(self):
+        return self.data[0, self.start:self.start + self.size]
+
+    @property
+    def y(self):
+        return self.data[1, self.start:self.start + self.size]
+
+
 # TODO: Show different data
 class Graph(tk.Frame):
-    def __init__(self, parent, title):
+    def __init__(self, parent, title, window=1000, ylim=(0, 180)):
         tk.Frame.__init__(self, parent)
         self.parent = parent
         self.title = title
-        self.x_axis = []
-        self.y_axis = []
+        self.values = RingBuffer(window)  # window of values for graph
         self.frames_cnt = 0
         self.seconds_cnt = 0
 
+        self.window = window
+        self.ylim = ylim
+        self.fig = None  # matplotlib is slow to import, the plot is made the first time there is something to show
+        self.background = None
+
+        self.placeholder = tk.Label(self, text='{} vs Time\nwaiting for a lock'.format(self.title),
+                                    width=40, height=20)  # about the size of the 3x3 inch plot
+        self.placeholder.pack()
+
+    def build(self):
+        import matplotlib.pyplot as plt
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
         self.fig = plt.figure(figsize=(3, 3))
         self.ax1 = self.fig.add_subplot(111)
+        self.ax1.set_title('{} vs Time'.format(self.title))
+        self.ax1.set_ylabel(self.title)
+        self.ax1.set_xlabel('frames')
+        self.ax1.set_ylim(self.ylim)
+        self.ax1.set_xlim(0, self.window)
+        # the line is left out of normal draws and blitted on top of the saved background instead
+        self.line, = self.ax1.plot([], [], animated=True)
+        self.fig.tight_layout()
+
+        self.placeholder.destroy()
         self.graph = FigureCanvasTkAgg(self.fig, master=self)
         self.graph.get_tk_widget().pack()
+        self.graph.mpl_connect('draw_event', self.on_draw)
 
     def increment_frames(self):
         self.frames_cnt += 1
@@ -118,21 +170,39 @@ class Graph(tk.Frame):
         self.seconds_cnt += 1
 
     def update_values(self, y_val):
-        self.x_axis.append(int(self.frames_cnt))
-        self.y_axis.append(int(y_val))
-        if len(self.x_axis) > 50:  # window of values for graph
-            self.x_axis.pop(0)
-            self.y_axis.pop(0)
+        self.values.append(self.frames_cnt, y_val)
+
+    # a full draw happened (first show, resize or new limits), keep what's under the line
+    def on_draw(self, event):
+        self.background = self.graph.copy_from_bbox(self.ax1.bbox)
+        self.ax1.draw_artist(self.line)
 
+    # the axes only move when the line runs off them, every other call just blits the line
     def animate(self):
-        self.ax1.clear()
-        self.ax1.set_title('{} vs Time'.format(self.title))
-        self.ax1.set_ylabel(self.title)
-        self.ax1.set_xlabel('frames')
-        self.ax1.set_ylim([0, 180])
-        self.ax1.plot(self.x_axis, self.y_axis)
-        self.fig.tight_layout()
-        self.graph.draw()
+        if self.values.size == 0:
+            return
+        if self.fig is None:
+            self.build()
+        x, y = self.values.x, self.values.y
+        self.line.set_data(x, y)
+
+        redraw = False
+        left, right = self.ax1.get_xlim()
+        if x[-1] > right:
+            span = right - left
+            self.ax1.set_xlim(x[-1] - span / 2, x[-1] + span / 2)  # jump half a window ahead
+            redraw = True
+        bottom, top = self.ax1.get_ylim()
+        if y.max() > top or y.min() < bottom:
+            self.ax1.set_ylim(min(bottom, y.min()), max(top, y.max() * 1.1))
+            redraw = True
+
+        if redraw or self.background is None:
+            self.graph.draw()  # on_draw saves the new background and draws the line
+        else:
+            self.graph.restore_region(self.background)
+            self.ax1.draw_artist(self.line)
+            self.graph.blit(self.ax1.bbox)
 
 
 class NavigationView(tk.Frame):
@@ -156,8 +226,19 @@ class NavigationView(tk.Frame):
         self.details_tab.grid(sticky='nsew',
                               padx=10, pady=10)
 
+        self.summary_frame = ttk.LabelFrame(self, text='Summary')
+        self.summary_frame.grid(row=0, column=3, sticky='nsew',
+                                padx=(5, 0), pady=(0, 5))
+        self.thumbnail = tk.Label(self.summary_frame)
+        self.thumbnail.grid(row=0, column=0, padx=(5, 2), pady=5)
+        self.heatmap = tk.Label(self.summary_frame)
+        self.heatmap.grid(row=0, column=1, padx=(2, 5), pady=5)
+        self.summary_text = tk.StringVar()
+        self.summary_label = tk.Label(self.summary_frame, textvariable=self.summary_text, justify='left')
+        self.summary_label.grid(row=1, column=0, columnspan=2, sticky='w', padx=5)
+
         self.actions_frame = ttk.LabelFrame(self, text='Actions')
-        self.actions_frame.grid(row=0, column=3,
+        self.actions_frame.grid(row=0, column=4,
                                 padx=(5, 5), pady=(0, 5),
                                 sticky='nsew')
         self.edit_button_text = tk.StringVar()
@@ -176,6 +257,9 @@ class NavigationView(tk.Frame):
         self.excel_button = tk.Button(self.actions_frame, text='Export to Excel')
         self.excel_button.grid(column=0, columnspan=2,
                                padx=25, pady=6)
+        self.export_all_button = tk.Button(self.actions_frame, text='Export All Runs')
+        self.export_all_button.grid(column=0, columnspan=2,
+                                    padx=25, pady=6)
         self.del_button = tk.Button(self.actions_frame, text='Delete Entry')
         self.del_button.grid(column=0, columnspan=2,
                              padx=25, pady=6)
@@ -186,10 +270,38 @@ class NavigationView(tk.Frame):
 
     def reload_entries(self, entry_list):
         self.entry_tab.update_list(entry_list)
+        if not entry_list:
+            self.show_summary(None)
+
+    # summary is a dict from DataLog.get_summary, the images are png bytes tk can show as they are
+    def show_summary(self, summary):
+        if summary is None:
+            self.summary_text.set('')
+            self.thumbnail.configure(image='')
+            self.heatmap.configure(image='')
+            return
+        minutes, seconds = divmod(int(summary['duration']), 60)
+        self.summary_text.set('Duration: {}:{:02d}    Samples: {}\n'
+                              'Locked: {:.0f}%    Path: {:.0f} px'.format(minutes, seconds, summary['samples'],
+                                                                        summary['lock_pct'],
+                                                                        summary['path_length']))
+        for label, name in [(self.thumbnail, 'thumbnail'), (self.heatmap, 'heatmap')]:
+            if summary[name] is None:
+                label.configure(image='')
+                continue
+            label.img = tk.PhotoImage(data=base64.b64encode(summary[name]))
+            label.configure(image=label.img)
 
     def reload_dates(self, date_list):
         self.date_tab.update_list(date_list)
 
+    # file to export every run to, '' if the dialog was cancelled
+    def ask_export_path(self):
+        return filedialog.asksaveasfilename(parent=self, title='Export all runs', initialdir=r'..\data',
+                                            initialfile='runs.csv', defaultextension='.csv',
+                                            filetypes=[('CSV', '*.csv'), ('Parquet', '*.parquet'),
+                                                       ('HDF5', '*.h5'), ('Excel (slow)', '*.xlsx')])
+
 
 class FileScrollTab(tk.Frame):
     def __init__(self, parent, title):
@@ -197,6 +309,7 @@ class FileScrollTab(tk.Frame):
         self.title = title
         self.parent = parent
         self.selection = ''
+        self.on_end = None  # called when the list is scrolled to the bottom
 
         self.date_label = tk.Label(self, text=title)
         self.date_label.grid(row=0, column=0, columnspan=2, sticky='ns')
@@ -204,13 +317,24 @@ class FileScrollTab(tk.Frame):
         scroll_bar.grid(row=1, column=1, sticky='ns')
 
         self.file_list = tk.Listbox(self)
+        self.scroll_bar = scroll_bar
         scroll_bar.config(command=self.file_list.yview)
-        self.file_list.config(yscrollcommand=scroll_bar.set)
+        self.file_list.config(yscrollcommand=self.on_scroll)
         self.file_list.configure(justify='center')
         self.file_list.grid(row=1, column=0)
 
+    def on_scroll(self, first, last):
+        self.scroll_bar.set(first, last)
+        if float(last) >= 1 and self.on_end is not None and self.size() > 0:
+            self.on_end()
+
     def update_list(self, curr_list):
         self.file_list.delete(0, 'end')
+        self.append_list(curr_list)
+
+    def append_list(self, curr_list):
+        if curr_list is None:
+            return
         for i in range(len(curr_list)):
             self.file_list.insert('end', curr_list[i])
 
@@ -310,23 +434,124 @@ class NoteEditWindow(tk.Toplevel):
 
 
 class ViewClipWindow(tk.Toplevel):
-    def __init__(self, parent, name):
+    def __init__(self, parent, name, trajectory=None):
         tk.Toplevel.__init__(self, parent)
         self.title(name)
         self.focus()
         self.vidFrame = tk.Label(self, text='Viewing Clip')
-        self.vidFrame.pack()
+        self.vidFrame.grid(row=0, column=0, columnspan=8)
         self.video = camera.VideoPlayback(name)
+        self.trajectory = trajectory
+        self.samples = None  # sample index of every frame of the clip, -1 where there is none
+        if trajectory is not None:
+            self.samples = data_handler.frame_samples(trajectory, self.video.frame_count)
+        self.pose = camera.Tracker()  # draws the logged samples like the live tracker
+
+        self.playing = True
+        self.speeds = ['0.25', '0.5', '1', '2', '4', '8', '16']
+        self.position = 0.0  # frame to show, fractional so slow speeds still advance
+        self.job = None
+
+        self.seek_bar = tk.Scale(self, from_=0, to=max(self.video.frame_count - 1, 0),
+                                 orient='horizontal', showvalue=False, command=self.on_seek)
+        self.seek_bar.grid(row=1, column=0, columnspan=8, sticky='ew')
+
+        self.back_button = tk.Button(self, text='<', command=lambda: self.step(-1))
+        self.back_button.grid(row=2, column=0)
+        self.play_text = tk.StringVar()
+        self.play_text.set('Pause')
+        self.play_button = tk.Button(self, textvariable=self.play_text, width=6, command=self.toggle_play)
+        self.play_button.grid(row=2, column=1)
+        self.forward_button = tk.Button(self, text='>', command=lambda: self.step(1))
+        self.forward_button.grid(row=2, column=2)
+
+        speed_label = tk.Label(self, text='Speed:')
+        speed_label.grid(row=2, column=3, sticky='e')
+        self.sel_speed = tk.StringVar()
+        self.speed_menu = ttk.OptionMenu(self, self.sel_speed, '1', *self.speeds)
+        self.speed_menu.grid(row=2, column=4, sticky='w')
+
+        self.show_track = tk.BooleanVar()
+        self.show_track.set(trajectory is not None and len(trajectory) > 0)
+        self.track_button = tk.Checkbutton(self, text='Track', variable=self.show_track,
+                                           command=self.show_frame)
+        self.track_button.grid(row=2, column=5)
+
+        self.info_text = tk.StringVar()
+        self.info = tk.Label(self, textvariable=self.info_text, width=40, anchor='w')
+        self.info.grid(row=2, column=6, columnspan=2, sticky='w')
+
+        self.bind('<space>', lambda e: self.toggle_play())
+        self.bind('<Left>', lambda e: self.step(-1))
+        self.bind('<Right>', lambda e: self.step(1))
+        self.protocol('WM_DELETE_WINDOW', self.close)
+
         self.show_frame()
+        self.play()
+
+    @property
+    def speed(self):
+        return float(self.sel_speed.get())
+
+    def toggle_play(self):
+        self.playing = not self.playing
+        self.play_text.set('Pause' if self.playing else 'Play')
+        if self.playing:
+            if int(self.position) >= self.video.frame_count - 1:
+                self.position = 0.0  # start over from the end
+            self.play()
+        elif self.job is not None:
+            self.after_cancel(self.job)
+            self.job = None
+
+    # fast speeds skip frames instead of asking tk for shorter periods than it can keep up with
+    def play(self):
+        if not self.playing:
+            return
+        period = max(int(self.video.refresh_period / self.speed), 15)
+        self.position += self.speed * period / self.video.refresh_period
+        if int(self.position) >= self.video.frame_count - 1:
+            self.position = max(self.video.frame_count - 1, 0)
+            self.show_frame()
+            self.toggle_play()  # stop at the end but stay open
+            return
+        self.show_frame()
+        self.job = self.after(period, self.play)
+
+    def step(self, frames):
+        if self.playing:
+            self.toggle_play()
+        self.position = min(max(int(self.position) + frames, 0), max(self.video.frame_count - 1, 0))
+        self.show_frame()
+
+    def on_seek(self, value):
+        if int(float(value)) != int(self.position):
+            self.position = float(value)
+            self.show_frame()
 
     def show_frame(self):
-        frame = self.video.get_frame()
-        if frame is not None:
-            frame = Image.fromarray(frame)
-            frame = ImageTk.PhotoImage(image=frame)
-            self.vidFrame.img = frame
-            self.vidFrame.configure(image=frame)
-            self.after(self.video.refresh_period, self.show_frame)
-        else:
-            print('Video Done')
-            self.destroy()
+        idx = int(self.position)
+        frame = self.video.read(idx)
+        if frame is None:
+            return
+        self.seek_bar.set(idx)
+        info = '{} / {}  {:.1f}s'.format(idx, self.video.frame_count, idx / self.video.framerate)
+        if self.samples is not None and idx < len(self.samples) and self.samples[idx] >= 0:
+            sample = self.trajectory[self.samples[idx]]
+            if sample['angle'] >= 0:
+                info += '  x {:.0f}  y {:.0f}  angle {:.0f}'.format(sample['x'], sample['y'], sample['angle'])
+            if self.show_track.get():
+                frame = frame.copy()  # the cached frame stays clean
+                # clips are stored as rgb, so the arrow is red as (255, 0, 0) here
+                render.draw_sample(frame, self.pose, self.trajectory, self.samples[idx], arrow_color=(255, 0, 0))
+        self.info_text.set(info)
+        frame = Image.fromarray(frame)
+        frame = ImageTk.PhotoImage(image=frame)
+        self.vidFrame.img = frame
+        self.vidFrame.configure(image=frame)
+
+    def close(self):
+        if self.job is not None:
+            self.after_cancel(self.job)
+        self.video.release()
+        self.destroy()